@@ -1,12 +1,44 @@
 """ The main module for the home assistant integration.
 Here the sniper can send home assistant events, and be configured using a home assistant instance.
 """
+import logging
+
+from .app.booking import BookingEngine
+from .app.change_feed import ChangeFeed, WebhookSubscriber
+from .app.schedule import ScheduleHandler
+from .app.toplogger import ToploggerApi
+from .integrations.home_assistant import SniperCoordinator, slot_delta_subscriber
+
 DOMAIN = "ToploggerSniper"
 
+_LOGGER = logging.getLogger(__name__)
+
 
 def setup(hass, config):
-    def my_service(call):
-        hass.states.set(f"{DOMAIN}.Hello_World", "Works!")
+    """Setup the sniper from the configuration, for example:
+
+    ToploggerSniper:
+      username: me@example.com
+      password: secret
+      gym: Monk Eindhoven
+      timespec: ...
+    """
+    conf = config[DOMAIN]
+    api = ToploggerApi()
+    if not api.login(conf["username"], conf["password"]):
+        _LOGGER.error("Could not login to Toplogger")
+        return False
+    if not api.pick_gym(conf["gym"]):
+        _LOGGER.error(f"Gym '{conf['gym']}' not found")
+        return False
 
-    hass.services.register(DOMAIN, "demo", my_service)
-    hass.states.set(f"{DOMAIN}.Hello_World", "unknown")
\ No newline at end of file
+    booking = BookingEngine(api) if conf.get("auto_book", False) else None
+    feed = ChangeFeed()
+    feed.subscribe(slot_delta_subscriber(hass))
+    if conf.get("webhook_url"):
+        feed.subscribe(WebhookSubscriber(conf["webhook_url"]))
+    coordinator = SniperCoordinator(hass, api, ScheduleHandler(conf), booking, feed)
+    coordinator.start()
+    hass.bus.listen_once("homeassistant_stop", coordinator.stop)
+    hass.data[DOMAIN] = coordinator
+    return True
@@ -0,0 +1,49 @@
+"""
+Cache of the reservation area ids of a gym, shared by the sync and async api.
+"""
+import time
+import typing
+
+AREA_CACHE_TTL = 3600.0
+
+
+class AreaCache:
+    """ Mapping of lowercase area name to the area id, valid for the ttl (seconds)."""
+
+    def __init__(self, ttl: float = AREA_CACHE_TTL):
+        self._ttl = ttl
+        self._area_ids: typing.Dict[str, int] = {}
+        self._fetched: typing.Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+
+    def set(self, area_ids: typing.Dict[str, int]):
+        """ Store freshly fetched area ids."""
+        self._area_ids = dict(area_ids)
+        self._fetched = time.monotonic()
+
+    def clear(self):
+        """ Drop the areas, the next lookup needs to fetch them again."""
+        self._area_ids = {}
+        self._fetched = None
+
+    @property
+    def valid(self) -> bool:
+        if self._fetched is None:
+            return False
+        return time.monotonic() - self._fetched < self._ttl
+
+    def needs_refresh(self) -> bool:
+        """ Whether the areas should be fetched before a lookup, counts hits and misses."""
+        if self.valid:
+            self.hits += 1
+            return False
+        self.misses += 1
+        return True
+
+    def get(self, area: str) -> typing.Optional[int]:
+        return self._area_ids.get(area.lower())
+
+    @property
+    def area_ids(self) -> typing.Dict[str, int]:
+        return dict(self._area_ids)
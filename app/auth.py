@@ -0,0 +1,198 @@
+"""
+Login token management, with re-login when the token expires.
+"""
+import logging
+import threading
+import time
+import typing
+
+import requests
+
+from . import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+# Login again in the background once the token is this old (in seconds).
+REFRESH_AFTER = 12 * 3600.0
+
+# Called with the email and the new token after every login.
+TokenListener = typing.Callable[[str, str], None]
+
+_TOKEN_HEADER = "X-USER-TOKEN"
+_EMAIL_HEADER = "X-USER-EMAIL"
+
+
+class AuthManager:
+    """Wraps the session to keep the authentication token valid.
+    Requests that carry the authentication headers always get the current token.
+    If the server answers 401, we login once with the stored credentials and replay
+    the request. Old tokens are refreshed in the background before they are used.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session,
+        login_url: str,
+        refresh_after: float = REFRESH_AFTER,
+    ):
+        self._session = session
+        self._login_url = login_url
+        self._refresh_after = refresh_after
+
+        self._email: typing.Optional[str] = None
+        self._password: typing.Optional[str] = None
+        self._token: typing.Optional[str] = None
+        self._token_time = 0.0
+
+        self._lock = threading.Lock()
+        # Held during a re-login, so concurrent 401s login only once.
+        self._relogin_lock = threading.Lock()
+        self._refreshing = False
+        self.relogins = 0
+        # Eg. to persist the tokens of re-logins and background refreshes.
+        self.on_token: typing.Optional[TokenListener] = None
+
+    def login(self, username: str, password: str) -> bool:
+        """ Login, and keep the credentials to login again later."""
+        tic = time.perf_counter()
+        r = self._session.post(
+            self._login_url,
+            json={"user": {"email": username, "password": password}},
+        )
+        metrics.record_request(
+            "LOGIN", r.status_code, time.perf_counter() - tic, len(r.content), "POST"
+        )
+
+        if r.status_code != 200:
+            return False
+
+        token = r.json()["authentication_token"]
+        with self._lock:
+            self._email = username
+            self._password = password
+            self._token = token
+            self._token_time = time.monotonic()
+
+        if self.on_token is not None:
+            try:
+                self.on_token(username, token)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Token listener failed")
+        return True
+
+    def restore(
+        self,
+        username: str,
+        token: str,
+        password: typing.Optional[str] = None,
+        age: float = 0.0,
+    ):
+        """Use the token of an earlier login, the password allows a re-login.
+        The age (in seconds) of the token decides when it is refreshed.
+        """
+        with self._lock:
+            self._email = username
+            self._token = token
+            self._token_time = time.monotonic() - age
+            if password is not None:
+                self._password = password
+
+    @property
+    def email(self) -> typing.Optional[str]:
+        return self._email
+
+    @property
+    def token(self) -> typing.Optional[str]:
+        return self._token
+
+    @property
+    def auth_header(self) -> dict:
+        """ The authentication header if a login has been done, otherwise an empty dict."""
+        if self._email and self._token:
+            return {_EMAIL_HEADER: self._email, _TOKEN_HEADER: self._token}
+        return {}
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """ Do a request, authenticated if the headers contain the token."""
+        if not headers or _TOKEN_HEADER not in headers:
+            return self._session.request(method, url, headers=headers, **kwargs)
+
+        self._refresh_if_old()
+        used_token = self._token
+        r = self._session.request(
+            method, url, headers={**headers, **self.auth_header}, **kwargs
+        )
+        if r.status_code == 401 and self._relogin(used_token):
+            # Release the connection of the rejected (possibly streamed) response.
+            r.close()
+            r = self._session.request(
+                method, url, headers={**headers, **self.auth_header}, **kwargs
+            )
+        return r
+
+    def send(self, prepared: requests.PreparedRequest) -> requests.Response:
+        """ Send a prepared request, with the current token."""
+        self._refresh_if_old()
+        used_token = self._token
+        prepared.headers.update(self.auth_header)
+        r = self._session.send(prepared)
+        if r.status_code == 401 and self._relogin(used_token):
+            r.close()
+            prepared.headers.update(self.auth_header)
+            r = self._session.send(prepared)
+        return r
+
+    def _relogin(self, used_token: typing.Optional[str]) -> bool:
+        """Login again because the used token was rejected.
+        Returns true if there is a new token to retry with.
+        """
+        with self._relogin_lock:
+            with self._lock:
+                if self._token != used_token:
+                    # Another request already logged in again.
+                    return True
+                email, password = self._email, self._password
+            if email is None or password is None:
+                _LOGGER.warning("Token expired, but there are no credentials to login")
+                return False
+
+            _LOGGER.info(f"Token of '{email}' expired, logging in again")
+            self.relogins += 1
+            return self.login(email, password)
+
+    def _refresh_if_old(self):
+        """ Login again in the background if the token is getting old."""
+        with self._lock:
+            if (
+                self._refreshing
+                or self._password is None
+                or time.monotonic() - self._token_time < self._refresh_after
+            ):
+                return
+            self._refreshing = True
+            email, password = self._email, self._password
+
+        def refresh():
+            refreshed = False
+            try:
+                refreshed = self.login(email, password)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+                    if not refreshed:
+                        # Keep the old token, a 401 will still trigger a re-login.
+                        self._token_time = time.monotonic()
+
+        threading.Thread(target=refresh, name="TokenRefresh", daemon=True).start()
@@ -0,0 +1,118 @@
+"""
+Automatically book shifts as soon as a spot opens up.
+"""
+import collections
+import datetime
+import logging
+import statistics
+import threading
+import time
+import typing
+
+from . import metrics
+from .schedule import ScheduleInstance, ShiftState
+from .toplogger import ClimbShift, PreparedBooking, ToploggerApi
+
+_LOGGER = logging.getLogger(__name__)
+
+# The number of latencies kept for the summary.
+LATENCY_SAMPLES = 1000
+
+
+class BookingEngine:
+    """Books the shifts of watched schedule instances once they become available.
+    The booking requests are built ahead of time, and every instance is booked at
+    most once, even if several polls see it available at the same time.
+    """
+
+    def __init__(self, api: ToploggerApi):
+        self._api = api
+        self._prepared: typing.Dict[
+            typing.Tuple[str, typing.Optional[str]], PreparedBooking
+        ] = {}
+        self._lock = threading.Lock()
+        self._in_flight: typing.Set[ScheduleInstance] = set()
+        self._booked: typing.Set[ScheduleInstance] = set()
+
+        # Seconds between detecting the open spot and the booking response.
+        self._latencies: typing.Deque[float] = collections.deque(
+            maxlen=LATENCY_SAMPLES
+        )
+        self.failures = 0
+
+    def prepare(self, instances: typing.Iterable[ScheduleInstance]):
+        """Build the booking requests for the instances that are watched.
+        The booked instances that passed are forgotten.
+        """
+        for inst in instances:
+            self._booking_for(inst)
+        now = datetime.datetime.now()
+        with self._lock:
+            self._booked = {inst for inst in self._booked if inst.time >= now}
+
+    def book(
+        self,
+        inst: ScheduleInstance,
+        shift: ClimbShift,
+        detected: typing.Optional[float] = None,
+    ) -> bool:
+        """Book the available shift of the schedule instance.
+        detected is the perf_counter time the open spot was seen, by default now.
+        Returns true if the shift was booked by this call. The caller skips the
+        instances that were taken before the poll, see poll_instances.
+        """
+        detected = detected if detected is not None else time.perf_counter()
+        if shift.slot_id is None:
+            _LOGGER.warning(f"Can not book {shift}, its slot is unknown")
+            return False
+
+        with self._lock:
+            if inst in self._booked or inst in self._in_flight:
+                return False
+            self._in_flight.add(inst)
+
+        try:
+            booked = self._api.book_prepared(self._booking_for(inst), shift.slot_id)
+        finally:
+            with self._lock:
+                self._in_flight.discard(inst)
+
+        if not booked:
+            self.failures += 1
+            return False
+
+        latency = time.perf_counter() - detected
+        with self._lock:
+            self._booked.add(inst)
+            self._latencies.append(latency)
+        metrics.REGISTRY.observe(
+            "booking_latency_seconds",
+            latency,
+            "Time from seeing an open spot to the booking response.",
+        )
+        inst.state = ShiftState.TAKEN
+        _LOGGER.info(f"Booked {shift} in {latency * 1000:.0f} ms")
+        return True
+
+    @property
+    def latencies(self) -> typing.List[float]:
+        """ The detection to booking latencies (in seconds) of the last bookings."""
+        return list(self._latencies)
+
+    def latency_summary(self) -> typing.Dict[str, float]:
+        """ The minimum, median and maximum booking latency in seconds."""
+        if not self._latencies:
+            return {}
+        return {
+            "count": len(self._latencies),
+            "min": min(self._latencies),
+            "median": statistics.median(self._latencies),
+            "max": max(self._latencies),
+        }
+
+    def _booking_for(self, inst: ScheduleInstance) -> PreparedBooking:
+        # A new login invalidates the prepared requests.
+        key = (inst.area or "", self._api.auth_header.get("X-USER-TOKEN"))
+        if key not in self._prepared:
+            self._prepared[key] = self._api.prepare_booking(inst.area or "")
+        return self._prepared[key]
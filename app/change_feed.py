@@ -0,0 +1,219 @@
+"""
+Change feed of the available slots: consecutive polls are diffed, and only the
+deltas are pushed to the subscribers.
+"""
+import asyncio
+import datetime
+import inspect
+import logging
+import threading
+import typing
+from collections import namedtuple
+
+import aiohttp
+
+from .toplogger import ClimbShift, ShiftKey
+
+_LOGGER = logging.getLogger(__name__)
+
+# The slots that opened, closed and moved for one gym, area and date.
+SlotDelta = namedtuple(
+    "SlotDelta", ["gym", "area", "date", "added", "removed", "changed"]
+)
+
+Subscriber = typing.Callable[[SlotDelta], typing.Optional[typing.Awaitable[None]]]
+SnapshotKey = typing.Tuple[str, str, datetime.date]
+
+WEBHOOK_TIMEOUT = 10.0
+
+
+def _slot_key(shift: ClimbShift) -> typing.Any:
+    return shift.slot_id if shift.slot_id is not None else (shift.start, shift.end)
+
+
+def delta_to_json(delta: SlotDelta) -> dict:
+    """ A json serializable version of a delta."""
+
+    def shifts(items: typing.Iterable[ClimbShift]) -> typing.List[dict]:
+        return [
+            {
+                "slot_id": shift.slot_id,
+                "start": shift.start.isoformat(),
+                "end": shift.end.isoformat(),
+            }
+            for shift in items
+        ]
+
+    return {
+        "gym": delta.gym,
+        "area": delta.area,
+        "date": delta.date.isoformat(),
+        "added": shifts(delta.added),
+        "removed": shifts(delta.removed),
+        "changed": shifts(delta.changed),
+    }
+
+
+def print_subscriber(delta: SlotDelta):
+    """ Print the delta to stdout."""
+    area = f"{delta.area} " if delta.area else ""
+    for shift in delta.added:
+        print(f"{delta.gym} {area}{shift.start:%A %d-%B %H:%M}: slot opened")
+    for shift in delta.changed:
+        print(f"{delta.gym} {area}{shift.start:%A %d-%B %H:%M}: slot moved")
+    for shift in delta.removed:
+        print(f"{delta.gym} {area}{shift.start:%A %d-%B %H:%M}: slot closed")
+
+
+class WebhookSubscriber:
+    """ Post every delta as json to a webhook."""
+
+    def __init__(self, url: str, timeout: float = WEBHOOK_TIMEOUT):
+        self._url = url
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+
+    async def __call__(self, delta: SlotDelta):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=self._timeout)
+        async with self._session.post(self._url, json=delta_to_json(delta)) as r:
+            if r.status >= 400:
+                _LOGGER.warning(f"Webhook {self._url} answered {r.status}")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class ChangeFeed:
+    """Keeps the last available slots per (gym, area, date), and pushes the
+    differences with the next poll to the subscribers through an asyncio queue.
+    Unchanged days cost a comparison of the interned shifts, and nothing is sent.
+    """
+
+    def __init__(self):
+        self._snapshots: typing.Dict[
+            SnapshotKey, typing.Dict[typing.Any, ClimbShift]
+        ] = {}
+        self._subscribers: typing.List[Subscriber] = []
+        self._cleaned = datetime.date.min
+        # The queue belongs to the loop of run, so it is created there. The deltas
+        # of the polls before that are kept in pending.
+        self._lock = threading.Lock()
+        self._queue: "typing.Optional[asyncio.Queue[typing.Optional[SlotDelta]]]" = None
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._pending: typing.List[SlotDelta] = []
+        self._running = threading.Event()
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def subscribe(self, subscriber: Subscriber):
+        """ Add a subscriber, a function or coroutine function taking a delta."""
+        self._subscribers.append(subscriber)
+
+    def diff(
+        self, gym: str, available: typing.Dict[ShiftKey, typing.List[ClimbShift]]
+    ) -> typing.List[SlotDelta]:
+        """Compare the available slots with the last snapshot, and store them.
+        A (date, area) that is not in available, eg. because fetching it failed,
+        keeps its snapshot and gives no delta.
+        """
+        deltas = []
+        for (date, area), shifts in available.items():
+            key = (gym, area, date)
+            old = self._snapshots.get(key, {})
+            new = {_slot_key(shift): shift for shift in shifts}
+            if len(old) == len(new) and all(
+                old.get(slot) is shift for slot, shift in new.items()
+            ):
+                continue
+            self._snapshots[key] = new
+
+            added = tuple(shift for slot, shift in new.items() if slot not in old)
+            removed = tuple(shift for slot, shift in old.items() if slot not in new)
+            changed = tuple(
+                shift
+                for slot, shift in new.items()
+                if slot in old
+                and (old[slot].start, old[slot].end) != (shift.start, shift.end)
+            )
+            if added or removed or changed:
+                deltas.append(SlotDelta(gym, area, date, added, removed, changed))
+        return deltas
+
+    def update(
+        self, gym: str, available: typing.Dict[ShiftKey, typing.List[ClimbShift]]
+    ) -> typing.List[SlotDelta]:
+        """ Diff the poll result, and queue the deltas for the subscribers."""
+        today = datetime.date.today()
+        if self._cleaned < today:
+            self.forget_before(today)
+            self._cleaned = today
+        deltas = self.diff(gym, available)
+        for delta in deltas:
+            self._put(delta)
+        return deltas
+
+    def forget_before(self, date: datetime.date):
+        """ Drop the snapshots of the days before the date."""
+        for key in [key for key in self._snapshots if key[2] < date]:
+            del self._snapshots[key]
+
+    async def run(self):
+        """ Deliver the queued deltas to the subscribers, until stop is called."""
+        queue: "asyncio.Queue[typing.Optional[SlotDelta]]" = asyncio.Queue()
+        with self._lock:
+            for delta in self._pending:
+                queue.put_nowait(delta)
+            self._pending = []
+            self._queue = queue
+            self._loop = asyncio.get_running_loop()
+        self._running.set()
+        try:
+            while True:
+                delta = await queue.get()
+                if delta is None:
+                    break
+                for subscriber in self._subscribers:
+                    try:
+                        result = subscriber(delta)
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception:  # pylint: disable=broad-except
+                        _LOGGER.exception(f"Subscriber {subscriber} failed")
+        finally:
+            self._running.clear()
+            with self._lock:
+                self._loop = None
+                self._queue = None
+            for subscriber in self._subscribers:
+                # Subscribers like the webhook hold a connection pool.
+                if inspect.iscoroutinefunction(getattr(subscriber, "close", None)):
+                    await subscriber.close()
+
+    def start(self):
+        """ Deliver the deltas from an event loop in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(self.run(),), name="ChangeFeed", daemon=True
+        )
+        self._thread.start()
+        self._running.wait()
+
+    def stop(self, timeout: typing.Optional[float] = None):
+        """ Stop delivering after the deltas that are queued already."""
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _put(self, delta: SlotDelta):
+        # The polls run in other threads than the event loop of the queue.
+        with self._lock:
+            if self._loop is None:
+                self._pending.append(delta)
+            else:
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, delta)
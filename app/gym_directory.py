@@ -0,0 +1,155 @@
+"""
+Directory of all gyms, shared by all api objects in the process.
+"""
+import bisect
+import difflib
+import logging
+import re
+import threading
+import time
+import typing
+import unicodedata
+
+import requests
+
+from . import metrics
+from .transport import resilient_session
+
+_LOGGER = logging.getLogger(__name__)
+
+DIRECTORY_TTL = 3600.0
+FUZZY_CUTOFF = 0.8
+
+
+def normalize(name: str) -> str:
+    """ Lowercase name without accents, punctuation and repeated whitespace."""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", name.lower()).split())
+
+
+class GymDirectory:
+    """Index of normalized gym name to gym id.
+    The gym list is fetched once, and refreshed in the background after the ttl.
+    """
+
+    _shared: typing.Dict[str, "GymDirectory"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        gyms_url: str,
+        ttl: float = DIRECTORY_TTL,
+        session: typing.Optional[requests.Session] = None,
+    ):
+        self._gyms_url = gyms_url
+        self._ttl = ttl
+        self._session = session if session is not None else resilient_session()
+
+        self._lock = threading.Lock()
+        # Held during the first fetch, so concurrent lookups fetch the list once.
+        self._load_lock = threading.Lock()
+        self._index: typing.Dict[str, int] = {}
+        self._names: typing.List[str] = []
+        self._fetched: typing.Optional[float] = None
+        self._timer: typing.Optional[threading.Timer] = None
+
+    @classmethod
+    def shared(
+        cls, gyms_url: str, session: typing.Optional[requests.Session] = None
+    ) -> "GymDirectory":
+        """The directory of the gyms url, shared by the whole process.
+        It is created with the session of the first caller, so the gyms are fetched
+        with its rate limit and retries.
+        """
+        with cls._shared_lock:
+            if gyms_url not in cls._shared:
+                cls._shared[gyms_url] = cls(gyms_url, session=session)
+            return cls._shared[gyms_url]
+
+    def lookup(self, name: str) -> typing.Optional[int]:
+        """Find the id of a gym.
+        Without an exact match, a unique prefix or a close match (typo) is used.
+        """
+        self._ensure_loaded()
+        key = normalize(name)
+        with self._lock:
+            if key in self._index:
+                return self._index[key]
+
+            match = self._prefix_match(key) or self._fuzzy_match(key)
+            if match is None:
+                return None
+            _LOGGER.warning(f"Gym '{name}' not found, using '{match}'")
+            return self._index[match]
+
+    def refresh(self) -> bool:
+        """ Fetch the gym list again, returns false if that failed."""
+        tic = time.perf_counter()
+        try:
+            r = self._session.get(self._gyms_url)
+        except requests.RequestException:
+            _LOGGER.exception("Could not fetch the gyms")
+            return False
+        metrics.record_request(
+            "ALL_GYMS", r.status_code, time.perf_counter() - tic, len(r.content)
+        )
+        if r.status_code != 200:
+            return False
+
+        index = {normalize(gym["name"]): gym["id"] for gym in r.json()}
+        with self._lock:
+            self._index = index
+            self._names = sorted(index)
+            self._fetched = time.monotonic()
+        return True
+
+    def stop(self):
+        """ Stop the background refresh."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._fetched is not None:
+                return
+        with self._load_lock:
+            with self._lock:
+                if self._fetched is not None:
+                    return
+            if self.refresh():
+                self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self._ttl, self._background_refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _background_refresh(self):
+        self.refresh()
+        with self._lock:
+            self._timer = None
+        self._schedule_refresh()
+
+    def _prefix_match(self, key: str) -> typing.Optional[str]:
+        idx = bisect.bisect_left(self._names, key)
+        matches = []
+        while idx < len(self._names) and self._names[idx].startswith(key):
+            matches.append(self._names[idx])
+            if len(matches) > 1:
+                # Ambiguous, don't guess.
+                return None
+            idx += 1
+        return matches[0] if matches else None
+
+    def _fuzzy_match(self, key: str) -> typing.Optional[str]:
+        matches = difflib.get_close_matches(key, self._names, n=1, cutoff=FUZZY_CUTOFF)
+        return matches[0] if matches else None
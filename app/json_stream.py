@@ -0,0 +1,71 @@
+"""
+Incremental parsing of json arrays, one item at a time.
+"""
+import codecs
+import json
+import typing
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(chunks: typing.Iterable[bytes]) -> typing.Iterator[typing.Any]:
+    """Yield the items of a json array, while the chunks of the document come in.
+    Only the item that is being parsed is kept in memory, not the whole document.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunk_iter = iter(chunks)
+    buffer = ""
+    pos = 0
+    started = False
+    done = False
+    eof = False
+
+    while not done:
+        # Skip whitespace and the separators between the items.
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos < len(buffer):
+            char = buffer[pos]
+            if not started:
+                if char != "[":
+                    raise ValueError(f"Expected a json array, got '{char}'")
+                started = True
+                pos += 1
+                continue
+            if char == "]":
+                done = True
+                continue
+            if char == ",":
+                pos += 1
+                continue
+
+            try:
+                item, end = _DECODER.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                item, end = None, None
+            if end is not None:
+                # Only a separator ends the item, a number could continue in the
+                # next chunk, eg. '1.' followed by '5'.
+                after = end
+                while after < len(buffer) and buffer[after] in _WHITESPACE:
+                    after += 1
+                if after < len(buffer) and buffer[after] in ",]":
+                    yield item
+                    pos = end
+                    continue
+                if eof and after < len(buffer):
+                    raise ValueError(f"Expected ',' or ']', got '{buffer[after]}'")
+
+        if eof:
+            raise ValueError("Unexpected end of the json array")
+        # Read more data, and drop the part that is parsed already.
+        chunk = next(chunk_iter, None)
+        if chunk is None:
+            eof = True
+            buffer = buffer[pos:] + decoder.decode(b"", final=True)
+        else:
+            buffer = buffer[pos:] + decoder.decode(chunk)
+        pos = 0
@@ -0,0 +1,159 @@
+"""
+Metrics of the hot paths, exported in the Prometheus text format.
+"""
+import bisect
+import contextlib
+import os
+import threading
+import time
+import typing
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+
+def _labels(labels: typing.Dict[str, typing.Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """ Counts of observations per bucket, with their sum."""
+
+    def __init__(self, buckets: typing.Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """ All counters, gauges and histograms, per name and label set."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: typing.Dict[str, typing.Tuple[str, str]] = {}
+        self._values: typing.Dict[str, typing.Dict[Labels, typing.Any]] = {}
+
+    def inc(self, name: str, amount: float = 1.0, help_text: str = "", **labels):
+        """ Increase a counter."""
+        with self._lock:
+            values = self._metric(name, "counter", help_text)
+            key = _labels(labels)
+            values[key] = values.get(key, 0.0) + amount
+
+    def set(self, name: str, value: float, help_text: str = "", **labels):
+        """ Set a gauge."""
+        with self._lock:
+            self._metric(name, "gauge", help_text)[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, help_text: str = "", **labels):
+        """ Add an observation to a histogram."""
+        with self._lock:
+            values = self._metric(name, "histogram", help_text)
+            key = _labels(labels)
+            if key not in values:
+                values[key] = Histogram()
+            values[key].observe(value)
+
+    @contextlib.contextmanager
+    def timed(self, name: str, help_text: str = "", **labels):
+        """ Observe the duration (in seconds) of the block in a histogram."""
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - tic, help_text, **labels)
+
+    def get(self, name: str, **labels) -> typing.Any:
+        """ The value of a counter or gauge, or the histogram. None if not present."""
+        with self._lock:
+            return self._values.get(name, {}).get(_labels(labels))
+
+    def clear(self):
+        with self._lock:
+            self._help.clear()
+            self._values.clear()
+
+    def export_prometheus(self) -> str:
+        """ All metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for name, values in sorted(self._values.items()):
+                metric_type, help_text = self._help[name]
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+                for labels, value in sorted(values.items()):
+                    if metric_type != "histogram":
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+                        continue
+
+                    cumulative = 0
+                    for bound, count in zip(value.buckets, value.counts):
+                        cumulative += count
+                        bucket_labels = _format_labels(labels, f'le="{bound}"')
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    inf_labels = _format_labels(labels, 'le="+Inf"')
+                    lines.append(f"{name}_bucket{inf_labels} {value.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """ Write the metrics to a file, which is replaced at once."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as metrics_file:
+            metrics_file.write(self.export_prometheus())
+        os.replace(tmp_path, path)
+
+    def _metric(
+        self, name: str, metric_type: str, help_text: str
+    ) -> typing.Dict[Labels, typing.Any]:
+        if name not in self._values:
+            self._help[name] = (metric_type, help_text)
+            self._values[name] = {}
+        return self._values[name]
+
+
+# The registry used by the whole process.
+REGISTRY = MetricsRegistry()
+
+
+def record_request(
+    endpoint: str, status_code: int, seconds: float, size: int, method: str = "GET"
+):
+    """ Record a single http request to the api."""
+    REGISTRY.observe(
+        "toplogger_http_request_seconds",
+        seconds,
+        "Latency of the api requests.",
+        endpoint=endpoint,
+        method=method,
+    )
+    REGISTRY.inc(
+        "toplogger_http_responses_total",
+        help_text="Api responses per status code.",
+        endpoint=endpoint,
+        status=status_code,
+    )
+    REGISTRY.inc(
+        "toplogger_http_response_bytes_total",
+        size,
+        "Size of the api response bodies.",
+        endpoint=endpoint,
+    )
@@ -0,0 +1,108 @@
+"""
+Determine the state of schedule instances from the api results.
+"""
+import itertools
+import threading
+import typing
+from collections import namedtuple
+
+import requests
+
+from .booking import BookingEngine
+from .schedule import ScheduleInstance, ShiftState
+from .shift_index import ShiftIndex
+from .toplogger import ClimbShift, ShiftKey, ToploggerApi
+
+# The available shifts per date and area, and the instances booked by the poll.
+PollResult = namedtuple("PollResult", ["available", "booked"])
+
+
+class PollError(requests.RequestException):
+    """ Raised when a poll got nothing from the api, so the poller backs off."""
+
+
+def apply_states(
+    instances: typing.Iterable[ScheduleInstance],
+    taken_shifts: typing.Iterable[ClimbShift],
+    available: typing.Dict[ShiftKey, typing.List[ClimbShift]],
+    on_available: typing.Optional[
+        typing.Callable[[ScheduleInstance, ClimbShift], typing.Any]
+    ] = None,
+):
+    """Set the state of every instance from the reservations and available shifts.
+    on_available is called right away for every instance with an open spot.
+    Instances of which the (date, area) is missing in available, because fetching
+    it failed, keep their state unless they are taken.
+    """
+    taken_index = ShiftIndex(taken_shifts)
+    available_index = ShiftIndex(itertools.chain.from_iterable(available.values()))
+
+    for inst in instances:
+        # First let's see if the shift is already taken, otherwise if it is available.
+        if taken_index.find(inst.time, inst.area) is not None:
+            inst.state = ShiftState.TAKEN
+            continue
+        if (inst.time.date(), inst.area or "") not in available:
+            continue
+
+        shift = available_index.find(inst.time, inst.area or "")
+        if shift is not None:
+            inst.state = ShiftState.AVAILABLE
+            if on_available is not None:
+                on_available(inst, shift)
+        else:
+            inst.state = ShiftState.FULL
+
+
+def poll_instances(
+    api: ToploggerApi,
+    instances: typing.List[ScheduleInstance],
+    booking: typing.Optional[BookingEngine] = None,
+    early_stop: bool = False,
+) -> PollResult:
+    """Fetch the reservations and available shifts, and update the instances.
+    With a booking engine, an available shift is booked as soon as the slots of its
+    date and area are in.
+    If the reservations or all of the shifts can not be fetched, the instances are
+    left as they are and PollError is raised. A shift we hold could otherwise look
+    available and be booked again.
+    With early_stop the slots of a day are only read up to the instances, the
+    available shifts of the result are then incomplete, see
+    get_available_shifts_bulk.
+    """
+    taken_shifts = api.get_reservations()
+    if taken_shifts is None:
+        raise PollError("Fetching the reservations failed")
+
+    # The states are overwritten by apply_states, so remember what we held.
+    was_taken = {inst for inst in instances if inst.state == ShiftState.TAKEN}
+    if booking is not None:
+        booking.prepare(instances)
+    per_key: typing.Dict[ShiftKey, typing.List[ScheduleInstance]] = {}
+    for inst in instances:
+        per_key.setdefault((inst.time.date(), inst.area or ""), []).append(inst)
+
+    lock = threading.Lock()
+    booked: typing.List[ScheduleInstance] = []
+
+    def on_fetched(key: ShiftKey, shifts: typing.List[ClimbShift], detected: float):
+        # Every (date, area) is applied and booked as soon as it is in, the other
+        # fetches of the poll are not waited for.
+        opened: typing.List[typing.Tuple[ScheduleInstance, ClimbShift]] = []
+        with lock:
+            apply_states(
+                per_key[key],
+                taken_shifts,
+                {key: shifts},
+                on_available=lambda inst, shift: opened.append((inst, shift)),
+            )
+        if booking is None:
+            return
+        for inst, shift in opened:
+            if inst not in was_taken and booking.book(inst, shift, detected):
+                booked.append(inst)
+
+    available = api.get_available_shifts_bulk(instances, early_stop, on_fetched)
+    if instances and not available:
+        raise PollError("Fetching the shifts failed")
+    return PollResult(available, booked)
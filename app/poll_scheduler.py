@@ -0,0 +1,178 @@
+"""
+Scheduler that polls every schedule instance at its own adaptive interval.
+"""
+import datetime
+import logging
+import random
+import threading
+import time
+import typing
+
+from .schedule import ScheduleHandler, ScheduleInstance, ShiftState
+
+_LOGGER = logging.getLogger(__name__)
+
+PollFunction = typing.Callable[[typing.List[ScheduleInstance]], None]
+
+
+class PollScheduler:
+    """Poll the schedule instances in a background thread.
+    Full shifts that start soon are polled fast, far away and taken shifts slowly.
+    On errors the polling backs off, and the amount of requests is capped by a
+    global budget. The instances of several schedules, eg. of the accounts of a
+    pool, can be polled with a single scheduler.
+    """
+
+    def __init__(
+        self,
+        poll: PollFunction,
+        sched: typing.Union[ScheduleHandler, typing.Sequence[ScheduleHandler]],
+        fast_interval: float = 10.0,
+        default_interval: float = 30.0,
+        slow_interval: float = 300.0,
+        near_window: datetime.timedelta = datetime.timedelta(hours=3),
+        far_window: datetime.timedelta = datetime.timedelta(days=2),
+        jitter: float = 0.1,
+        max_backoff: float = 600.0,
+        max_requests_per_minute: float = 60.0,
+    ):
+        self._poll = poll
+        self._scheds = list(sched) if isinstance(sched, (list, tuple)) else [sched]
+        self._fast_interval = fast_interval
+        self._default_interval = default_interval
+        self._slow_interval = slow_interval
+        self._near_window = near_window
+        self._far_window = far_window
+        self._jitter = jitter
+        self._max_backoff = max_backoff
+
+        # Token bucket, filled with one minute worth of requests.
+        self._budget_rate = max_requests_per_minute / 60.0
+        self._budget_max = max_requests_per_minute
+        self._budget = max_requests_per_minute
+        self._budget_time = time.monotonic()
+
+        self._next_poll: typing.Dict[ScheduleInstance, float] = {}
+        self._errors = 0
+        self._stop = threading.Event()
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def interval_for(
+        self, inst: ScheduleInstance, now: typing.Optional[datetime.datetime] = None
+    ) -> float:
+        """ The poll interval (in seconds) for a schedule instance."""
+        now = now or datetime.datetime.now()
+        until_start = inst.time - now
+
+        if inst.state == ShiftState.TAKEN or until_start > self._far_window:
+            return self._slow_interval
+        if inst.state == ShiftState.FULL and until_start <= self._near_window:
+            return self._fast_interval
+        return self._default_interval
+
+    def start(self):
+        """ Start polling in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="PollScheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: typing.Optional[float] = None):
+        """ Stop polling, and wait till the running poll is finished."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_once(self) -> float:
+        """Poll all instances that are due.
+        Returns the time (in seconds) till the next instance is due.
+        """
+        for sched in self._scheds:
+            sched.update()
+        now = time.monotonic()
+
+        # Forget about the instances that are no longer scheduled.
+        current = [
+            inst
+            for sched in self._scheds
+            for inst in sched.get_dates(include_taken=True)
+        ]
+        self._next_poll = {inst: self._next_poll.get(inst, now) for inst in current}
+
+        due = sorted(
+            (inst for inst in current if self._next_poll[inst] <= now),
+            key=lambda inst: self._next_poll[inst],
+        )
+        due = self._within_budget(due)
+
+        if due:
+            try:
+                self._poll(due)
+            except Exception:  # pylint: disable=broad-except
+                self._errors += 1
+                backoff = min(
+                    self._default_interval * 2 ** self._errors, self._max_backoff
+                )
+                _LOGGER.exception(f"Poll failed, retrying in {backoff:.0f} seconds")
+                for inst in due:
+                    self._next_poll[inst] = now + self._jittered(backoff)
+            else:
+                self._errors = 0
+                for inst in due:
+                    self._next_poll[inst] = now + self._jittered(
+                        self.interval_for(inst)
+                    )
+
+        if not self._next_poll:
+            return self._default_interval
+        return max(0.0, min(self._next_poll.values()) - time.monotonic())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                wait = self.run_once()
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Unexpected error in the poll scheduler")
+                wait = self._default_interval
+            # Never spin, even if a poll is already due again.
+            self._stop.wait(max(wait, 1.0))
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1.0 - self._jitter, 1.0 + self._jitter)
+
+    def _within_budget(
+        self, due: typing.List[ScheduleInstance]
+    ) -> typing.List[ScheduleInstance]:
+        """Limit the due instances to the request budget.
+        A poll costs one request for the reservations and one per (date, area).
+        """
+        now = time.monotonic()
+        self._budget = min(
+            self._budget_max,
+            self._budget + (now - self._budget_time) * self._budget_rate,
+        )
+        self._budget_time = now
+
+        groups: typing.Set[typing.Tuple[datetime.date, str]] = set()
+        allowed = []
+        for inst in due:
+            key = (inst.time.date(), inst.area or "")
+            cost = len(groups | {key}) + 1
+            if cost > self._budget:
+                break
+            groups.add(key)
+            allowed.append(inst)
+
+        if allowed:
+            self._budget -= len(groups) + 1
+        if len(allowed) < len(due):
+            _LOGGER.debug(f"Request budget reached, {len(due) - len(allowed)} delayed")
+        return allowed
@@ -0,0 +1,159 @@
+"""
+Snipe for several accounts and gyms from a single process.
+"""
+import concurrent.futures
+import logging
+import typing
+
+from . import metrics
+from .poll import PollError, apply_states
+from .response_cache import ResponseCache
+from .schedule import ScheduleHandler, ScheduleInstance
+from .toplogger import MAX_CONCURRENCY, URL, ClimbShift, ShiftKey, ToploggerApi
+from .transport import resilient_session
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_WORKERS = 8
+
+
+class Account:
+    """ A single account, with its own login and schedule."""
+
+    def __init__(self, config: dict, api: ToploggerApi):
+        self.username: str = config["username"]
+        self._password: str = config["password"]
+        self.sched = ScheduleHandler(config)
+        self.api = api
+
+    def login(self) -> bool:
+        """ Login and pick the gym of the schedule."""
+        if not self.api.login(self.username, self._password):
+            _LOGGER.error(f"Login failed for '{self.username}'")
+            return False
+        if not self.api.pick_gym(self.sched.gym):
+            _LOGGER.error(f"Gym '{self.sched.gym}' of '{self.username}' not found")
+            return False
+        return True
+
+
+class SniperPool:
+    """Poll the schedules of many accounts.
+    All accounts share one connection pool and response cache, but each has its own
+    login. The slots of a gym are fetched once per poll for all accounts watching it.
+    """
+
+    def __init__(
+        self,
+        configs: typing.Iterable[dict],
+        max_workers: int = MAX_WORKERS,
+        url=URL,
+        **transport_options,
+    ):
+        # The transport options go to the resilient adapter, eg. the rate limit.
+        # Every worker can fetch the slots of its gym in parallel.
+        self._session = resilient_session(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers * MAX_CONCURRENCY,
+            **transport_options,
+        )
+        self._cache = ResponseCache()
+
+        self._accounts = [
+            Account(config, self._create_api(url)) for config in configs
+        ]
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+
+    def _create_api(self, url: str) -> ToploggerApi:
+        """ An api object with its own login, on the shared connection pool."""
+        return ToploggerApi(url=url, response_cache=self._cache, session=self._session)
+
+    @property
+    def accounts(self) -> typing.List[Account]:
+        return self._accounts
+
+    def login(self) -> bool:
+        """ Login all accounts, returns true if all of them succeeded."""
+        return all(self._executor.map(lambda account: account.login(), self._accounts))
+
+    def poll(self, instances: typing.Optional[typing.List[ScheduleInstance]] = None):
+        """Update the states of the schedule instances of all accounts.
+        With a list of instances, eg. the due instances of a poll scheduler, only
+        those are polled.
+        """
+        with metrics.REGISTRY.timed(
+            "poll_cycle_seconds", "Duration of a complete poll.", mode="pool"
+        ):
+            self._poll(instances)
+
+    def _poll(self, instances: typing.Optional[typing.List[ScheduleInstance]]):
+        due = None if instances is None else set(instances)
+
+        # Group the accounts on the gym they watch, with their instances to poll.
+        gyms: typing.Dict[
+            int, typing.List[typing.Tuple[Account, typing.List[ScheduleInstance]]]
+        ] = {}
+        for account in self._accounts:
+            if account.api.gym_id is None:
+                continue
+            account.sched.update()
+            watched = [
+                inst
+                for inst in account.sched.get_dates(include_taken=True)
+                if due is None or inst in due
+            ]
+            if watched:
+                gyms.setdefault(account.api.gym_id, []).append((account, watched))
+
+        reservations = {
+            account: self._executor.submit(account.api.get_reservations)
+            for accounts in gyms.values()
+            for account, _ in accounts
+        }
+        # The public slot data is fetched once per gym, for the union of all accounts.
+        available = {
+            gym_id: self._executor.submit(self._gym_shifts, accounts)
+            for gym_id, accounts in gyms.items()
+        }
+
+        updated = 0
+        for gym_id, accounts in gyms.items():
+            gym_shifts = available[gym_id].result()
+            if not gym_shifts:
+                _LOGGER.warning(f"Fetching the shifts of gym {gym_id} failed")
+                continue
+            for account, watched in accounts:
+                taken_shifts = reservations[account].result()
+                if taken_shifts is None:
+                    _LOGGER.warning(
+                        f"Fetching the reservations of '{account.username}' failed"
+                    )
+                    continue
+                apply_states(watched, taken_shifts, gym_shifts)
+                updated += 1
+
+        if gyms and not updated:
+            # Nothing came through, so the poll scheduler backs off.
+            raise PollError("No account could fetch its shifts and reservations")
+
+    def updates(self) -> typing.Generator[
+        typing.Tuple[Account, ScheduleInstance], None, None
+    ]:
+        """ The instances of which the state changed, they are marked processed."""
+        for account in self._accounts:
+            for inst in account.sched.get_dates(include_taken=True):
+                if inst.has_update:
+                    inst.processed()
+                    yield account, inst
+
+    def close(self):
+        """ Stop the workers and close the connection pool."""
+        self._executor.shutdown()
+        self._session.close()
+
+    @staticmethod
+    def _gym_shifts(
+        accounts: typing.List[typing.Tuple[Account, typing.List[ScheduleInstance]]],
+    ) -> typing.Dict[ShiftKey, typing.List[ClimbShift]]:
+        instances = [inst for _, watched in accounts for inst in watched]
+        return accounts[0][0].api.get_available_shifts_bulk(instances)
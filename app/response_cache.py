@@ -0,0 +1,180 @@
+"""
+Cache of parsed api responses, revalidated with conditional requests.
+"""
+import collections
+import hashlib
+import threading
+import time
+import typing
+
+import requests
+
+from . import metrics
+
+if typing.TYPE_CHECKING:
+    from .auth import AuthManager
+
+MAX_ENTRIES = 256
+
+# How long (in seconds) a response is used without asking the server, per endpoint.
+# A ttl of 0 means every lookup is revalidated.
+DEFAULT_TTLS: typing.Dict[str, float] = {
+    "AREAS": 600.0,
+    "SHIFTS": 0.0,
+    "RESERVATIONS": 0.0,
+}
+
+CacheKey = typing.Tuple[str, typing.Tuple[typing.Tuple[str, str], ...], str]
+
+
+class _CacheEntry:
+    """ A single cached response."""
+
+    def __init__(
+        self, response: requests.Response, body_hash: bytes, parsed: typing.Any
+    ):
+        self.etag: typing.Optional[str] = response.headers.get("ETag")
+        self.last_modified: typing.Optional[str] = response.headers.get(
+            "Last-Modified"
+        )
+        self.body_hash = body_hash
+        self.parsed = parsed
+        self.fetched = time.monotonic()
+
+    def refresh(self, response: requests.Response):
+        """ The server confirmed the entry is still valid."""
+        self.etag = response.headers.get("ETag", self.etag)
+        self.last_modified = response.headers.get("Last-Modified", self.last_modified)
+        self.fetched = time.monotonic()
+
+    @property
+    def conditional_headers(self) -> typing.Dict[str, str]:
+        """ The headers to ask the server whether the response changed."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """LRU cache of parsed json responses.
+    The server is asked with If-None-Match / If-Modified-Since whether a response
+    changed. If it does not support that, the body hash is compared instead, so an
+    unchanged body is never parsed again.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = MAX_ENTRIES,
+        ttls: typing.Optional[typing.Dict[str, float]] = None,
+    ):
+        self._max_entries = max_entries
+        self._ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self._ttls.update(ttls)
+        self._entries: "collections.OrderedDict[CacheKey, _CacheEntry]" = (
+            collections.OrderedDict()
+        )
+        # The cache can be shared by the api objects of several threads.
+        self._lock = threading.Lock()
+        # Concurrent lookups of the same url wait for a single request.
+        self._key_locks: typing.Dict[CacheKey, threading.Lock] = {}
+
+        self.fresh_hits = 0
+        self.not_modified = 0
+        self.unchanged = 0
+        self.misses = 0
+
+    def get(
+        self,
+        session: typing.Union[requests.Session, "AuthManager"],
+        endpoint: str,
+        url: str,
+        parse: typing.Callable[[typing.Any], typing.Any],
+        params: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> typing.Any:
+        """Get the parsed response of an url.
+        Returns None if the request failed.
+        """
+        headers = headers or {}
+        key = self._key(url, params, headers)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            return self._get(session, endpoint, key, url, parse, params, headers)
+
+    def _get(
+        self,
+        session: typing.Union[requests.Session, "AuthManager"],
+        endpoint: str,
+        key: CacheKey,
+        url: str,
+        parse: typing.Callable[[typing.Any], typing.Any],
+        params: typing.Optional[typing.Dict[str, typing.Any]],
+        headers: typing.Dict[str, str],
+    ) -> typing.Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            if time.monotonic() - entry.fetched < self._ttls.get(endpoint, 0.0):
+                self.fresh_hits += 1
+                return entry.parsed
+            headers = {**headers, **entry.conditional_headers}
+
+        tic = time.perf_counter()
+        r = session.get(url, params=params, headers=headers)
+        metrics.record_request(
+            endpoint, r.status_code, time.perf_counter() - tic, len(r.content)
+        )
+
+        if r.status_code == 304 and entry is not None:
+            self.not_modified += 1
+            entry.refresh(r)
+            return entry.parsed
+
+        if r.status_code != 200:
+            return None
+
+        body_hash = hashlib.sha1(r.content).digest()
+        if entry is not None and entry.body_hash == body_hash:
+            self.unchanged += 1
+            entry.refresh(r)
+            return entry.parsed
+
+        self.misses += 1
+        parsed = parse(r.json())
+        with self._lock:
+            self._entries[key] = _CacheEntry(r, body_hash, parsed)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._key_locks.pop(evicted, None)
+        return parsed
+
+    def invalidate(self, url: typing.Optional[str] = None):
+        """ Drop all entries, or only those of the given url."""
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == url]:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(
+        url: str,
+        params: typing.Optional[typing.Dict[str, typing.Any]],
+        headers: typing.Dict[str, str],
+    ) -> CacheKey:
+        # Responses that depend on the user should never be shared between users.
+        param_items = tuple(sorted((k, str(v)) for k, v in (params or {}).items()))
+        return (url, param_items, headers.get("X-USER-EMAIL", ""))
@@ -4,11 +4,49 @@ Module handling the schedule configuration.
 import typing
 import datetime
 import calendar
+import collections
 import enum
 from collections import namedtuple
 
-ListInst = namedtuple("ListInst", ["time", "area"])
-SchedDict = typing.Dict[str, typing.List[ListInst]]
+from . import metrics
+
+# A configured time in the week, as the minute of the day and the area.
+TimetableEntry = namedtuple("TimetableEntry", ["minute", "area"])
+# The sorted entries of every weekday, indexed like datetime.weekday().
+Timetable = typing.Tuple[typing.Tuple[TimetableEntry, ...], ...]
+
+_DAY_KEYS = {
+    key: weekday
+    for weekday, day in enumerate(calendar.day_name)
+    for key in (day.lower(), day[:3].lower())
+}
+
+
+def compile_timetable(config: dict) -> Timetable:
+    """Compile the timespec configuration into the sorted entries per weekday.
+    Both the full day name (eg. monday) and the shortcut (eg. mon) are allowed,
+    duplicated times are merged and invalid entries raise a ValueError.
+    """
+    days: typing.List[typing.Set[TimetableEntry]] = [set() for _ in range(7)]
+    for key, specs in config.items():
+        weekday = _DAY_KEYS.get(key.lower())
+        if weekday is None:
+            raise ValueError(f"Unknown day in the timespec: '{key}'")
+
+        for spec in specs or []:
+            try:
+                hour, minute = int(spec["hour"]), int(spec.get("minute", 0))
+                area = spec["area"]
+            except (KeyError, TypeError, ValueError) as err:
+                raise ValueError(f"Invalid timespec on {key}: {spec}") from err
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                raise ValueError(f"Invalid time on {key}: {hour}:{minute:02d}")
+            days[weekday].add(TimetableEntry(hour * 60 + minute, area))
+
+    return tuple(
+        tuple(sorted(entries, key=lambda entry: (entry.minute, entry.area or "")))
+        for entries in days
+    )
 
 
 class ShiftState(enum.Enum):
@@ -23,13 +61,22 @@ class ShiftState(enum.Enum):
 class ScheduleInstance:
     """ A single instance in of the schedule."""
 
+    __slots__ = ("_datetime", "_area", "_state", "_statechange", "_on_state_change")
+
     def __init__(
-        self, datetime_spec: datetime.datetime, area: typing.Optional[str] = None
+        self,
+        datetime_spec: datetime.datetime,
+        area: typing.Optional[str] = None,
+        on_state_change: typing.Optional[
+            typing.Callable[["ScheduleInstance"], None]
+        ] = None,
+        state: ShiftState = ShiftState.UNKNOWN,
     ):
         self._datetime = datetime_spec
         self._area = area
-        self._state: ShiftState = ShiftState.UNKNOWN
+        self._state: ShiftState = state
         self._statechange: bool = False
+        self._on_state_change = on_state_change
 
     def processed(self):
         """ Call this method once a statechange was processed."""
@@ -61,6 +108,8 @@ class ScheduleInstance:
         if self.state != new_state:
             self._state = new_state
             self._statechange = True
+            if self._on_state_change is not None:
+                self._on_state_change(self)
 
     def __str__(self) -> str:
         area_str = f"at {self.area} " if self.area else ""
@@ -72,14 +121,36 @@ class ScheduleInstance:
 class ScheduleHandler:
     """ Obtain the schedule configuration and get the relevant timespecs."""
 
-    def __init__(self, config):
+    def __init__(
+        self,
+        config,
+        known_states: typing.Optional[
+            typing.Dict[
+                typing.Tuple[datetime.datetime, typing.Optional[str]], ShiftState
+            ]
+        ] = None,
+    ):
         self._gym = config["gym"]
+        # The states of earlier runs, new instances start in these states.
+        self._known_states = known_states or {}
         self.__plan_advance = config.get("days", 6)
-        self._configs: SchedDict = {k.lower(): [] for k in calendar.day_name}
-
-        self.__read_config(config["timespec"])
+        self._timetable = compile_timetable(config["timespec"])
+        # The same timetable, with the offsets from midnight to create the instances.
+        self.__offsets = tuple(
+            tuple(
+                (datetime.timedelta(minutes=entry.minute), entry.area)
+                for entry in entries
+            )
+            for entries in self._timetable
+        )
 
-        self.__current_specs: typing.List[ScheduleInstance] = []
+        # All instances in order of time. New days are always later than the planned
+        # ones and passed instances are at the front, so the order stays sorted.
+        self.__current_specs: typing.Deque[ScheduleInstance] = collections.deque()
+        # The instances that are not taken, in order of time while not marked unsorted.
+        self.__live: typing.Dict[ScheduleInstance, None] = {}
+        self.__live_sorted = True
+        self.__expired_before = datetime.datetime.min
         self.__last_updateday = datetime.datetime.now() - datetime.timedelta(days=1)
 
     @property
@@ -87,43 +158,79 @@ class ScheduleHandler:
         """ The gym of this schedule handler."""
         return self._gym
 
-    def get_dates(self) -> typing.Generator[ScheduleInstance, None, None]:
-        """ Get the current dates that are not yet taken."""
-        for inst in self.__current_specs:
-            if not inst.state == ShiftState.TAKEN:
-                yield inst
+    @property
+    def timetable(self) -> Timetable:
+        """ The configured entries of every weekday, monday first."""
+        return self._timetable
+
+    def get_dates(
+        self, include_taken: bool = False
+    ) -> typing.Generator[ScheduleInstance, None, None]:
+        """ Get the current dates that are not yet taken, or all dates if requested."""
+        # Copy, as the states (and thus the live instances) change while iterating.
+        if include_taken:
+            yield from list(self.__current_specs)
+            return
+        if not self.__live_sorted:
+            self.__live = dict.fromkeys(sorted(self.__live, key=lambda inst: inst.time))
+            self.__live_sorted = True
+        yield from list(self.__live)
 
     def update(self):
         """ Update the schedule."""
+        with metrics.REGISTRY.timed(
+            "schedule_update_seconds", "Duration of the schedule updates."
+        ):
+            self._update()
+
+    def _update(self):
         # First we should clear the passed times.
         today = datetime.datetime.now()
 
-        # Remove any instances that have passed in time.
-        self.__current_specs[:] = [x for x in self.__current_specs if x.time >= today]
+        # Remove any instances that have passed in time, these are at the front.
+        self.__expired_before = today
+        while self.__current_specs and self.__current_specs[0].time < today:
+            inst = self.__current_specs.popleft()
+            self.__live.pop(inst, None)
 
         # Let's generate new specs if necessary
         generate_day = today + datetime.timedelta(days=self.__plan_advance)
-        while self.__last_updateday.date() <= generate_day.date():
-            self.__last_updateday += datetime.timedelta(days=1)
-            self.__current_specs += self._generate_specs(self.__last_updateday)
-
-    def _generate_specs(self, day: datetime.datetime) -> typing.List[ScheduleInstance]:
-        dayname = calendar.day_name[day.weekday()].lower()
+        days = (generate_day.date() - self.__last_updateday.date()).days
+        if days < 0:
+            return
+        first_day = self.__last_updateday.date() + datetime.timedelta(days=1)
+        self.__last_updateday += datetime.timedelta(days=days + 1)
+
+        for inst in self._generate_specs(first_day, days + 1):
+            self.__current_specs.append(inst)
+            if inst.state != ShiftState.TAKEN:
+                self.__live[inst] = None
+
+    def __state_changed(self, inst: ScheduleInstance):
+        """ Keep the live instances up to date with the state of an instance."""
+        if inst.state == ShiftState.TAKEN:
+            self.__live.pop(inst, None)
+        elif inst.time >= self.__expired_before and inst not in self.__live:
+            # No longer taken, it is added at the end and sorted once when needed.
+            self.__live[inst] = None
+            self.__live_sorted = False
+
+    def _generate_specs(
+        self, first_day: datetime.date, days: int = 1
+    ) -> typing.List[ScheduleInstance]:
+        """ The instances of a number of days, in order of time."""
         ret_list = []
-
-        for timespec in self._configs.get(dayname, []):
-            timing = datetime.datetime.combine(day.date(), timespec.time)
-            ret_list.append(ScheduleInstance(timing, timespec.area))
+        midnight = datetime.datetime.combine(first_day, datetime.time())
+        weekday = first_day.weekday()
+        one_day = datetime.timedelta(days=1)
+
+        for _ in range(days):
+            for offset, area in self.__offsets[weekday]:
+                timing = midnight + offset
+                state = self._known_states.pop((timing, area), ShiftState.UNKNOWN)
+                ret_list.append(
+                    ScheduleInstance(timing, area, self.__state_changed, state)
+                )
+            midnight += one_day
+            weekday = (weekday + 1) % 7
         return ret_list
-
-    def __read_config(self, config: dict):
-        """ Read the configuration into the class."""
-        for day in calendar.day_name:
-            day = day.lower()
-            # We allow both the full day name (eg. monday) as the shortcut (eg. mon)
-            input_list = config.get(day, []) + config.get(day[:3], [])
-
-            for spec in input_list:
-                spec_time = datetime.time(spec["hour"], spec.get("minute", 0))
-                list_inst = ListInst(time=spec_time, area=spec["area"])
-                self._configs[day].append(list_inst)
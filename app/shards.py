@@ -0,0 +1,286 @@
+"""
+Poll very large watch lists from several processes, sharded on the gym id.
+"""
+import datetime
+import logging
+import multiprocessing
+import os
+import time
+import typing
+from collections import namedtuple
+from multiprocessing.connection import Connection
+
+from . import metrics
+from .gym_directory import GymDirectory
+from .pool import SniperPool
+from .schedule import ShiftState
+from .toplogger import URL, _ApiPath
+from .transport import resilient_session
+
+_LOGGER = logging.getLogger(__name__)
+
+# How long (in seconds) to wait for the login and for a poll of a shard.
+START_TIMEOUT = 60.0
+POLL_TIMEOUT = 120.0
+
+# Health of a shard as last reported by its worker process.
+ShardHealth = namedtuple(
+    "ShardHealth",
+    ["shard", "alive", "accounts", "polls", "errors", "poll_seconds", "last_error"],
+)
+
+# The state of an instance of an account: (username, time, area).
+StateKey = typing.Tuple[str, datetime.datetime, typing.Optional[str]]
+# An update sent back by a worker: (username, time, area, state name).
+_Update = typing.Tuple[str, datetime.datetime, typing.Optional[str], str]
+
+
+def _run_shard(
+    configs: typing.List[dict], url: str, transport_options: dict, conn: Connection
+):
+    """The worker process of a shard, polls its accounts on request.
+    A (command, sequence) message is answered with (status, payload, seconds,
+    sequence), so a late answer to an earlier poll is recognized.
+    """
+    pool = SniperPool(configs, url=url, **transport_options)
+    try:
+        conn.send(("ready", pool.login(), 0.0, 0))
+        while True:
+            command, sequence = conn.recv()
+            if command != "poll":
+                break
+            tic = time.perf_counter()
+            try:
+                pool.poll()
+                updates: typing.List[_Update] = [
+                    (account.username, inst.time, inst.area, inst.state.name)
+                    for account, inst in pool.updates()
+                ]
+            except Exception as err:  # pylint: disable=broad-except
+                conn.send(("error", repr(err), time.perf_counter() - tic, sequence))
+            else:
+                conn.send(("result", updates, time.perf_counter() - tic, sequence))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        pool.close()
+        conn.close()
+
+
+class _Shard:
+    """ The parent side of a shard: its process, pipe and health."""
+
+    def __init__(self, index: int, configs: typing.List[dict]):
+        self.index = index
+        self.configs = configs
+        self.process: typing.Optional[multiprocessing.process.BaseProcess] = None
+        self.conn: typing.Optional[Connection] = None
+        self.polls = 0
+        self.errors = 0
+        self.poll_seconds = 0.0
+        self.last_error: typing.Optional[str] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def receive(
+        self, sequence: int, timeout: float
+    ) -> typing.Optional[typing.Tuple[str, typing.Any, float]]:
+        """The answer of the worker to a message, None if it did not answer in time.
+        Late answers to earlier messages are dropped.
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            while self.conn is not None and self.conn.poll(
+                max(0.0, deadline - time.monotonic())
+            ):
+                status, payload, seconds, answered = self.conn.recv()
+                if answered == sequence:
+                    return status, payload, seconds
+        except (EOFError, OSError):
+            pass
+        return None
+
+    def failed(self, error: str):
+        self.errors += 1
+        self.last_error = error
+        _LOGGER.error(f"Shard {self.index} failed: {error}")
+
+
+class ShardedPoller:
+    """Poll the accounts from worker processes, one shard per process.
+    Accounts are sharded on the id of their gym, so the slots of a gym are still
+    fetched once per poll. Every worker has its own sessions and logins, and sends
+    the changed states back over a pipe into the state table of this process.
+    """
+
+    def __init__(
+        self,
+        configs: typing.Iterable[dict],
+        processes: typing.Optional[int] = None,
+        url: str = URL,
+        **transport_options,
+    ):
+        self._url = url
+        self._transport_options = transport_options
+        self._context = multiprocessing.get_context("spawn")
+        processes = processes or os.cpu_count() or 1
+
+        directory = GymDirectory.shared(
+            _ApiPath.ALL_GYMS.url(url), resilient_session(**transport_options)
+        )
+        shard_configs: typing.List[typing.List[dict]] = [[] for _ in range(processes)]
+        for config in configs:
+            gym_id = directory.lookup(config["gym"])
+            if gym_id is None:
+                _LOGGER.error(
+                    f"Gym '{config['gym']}' of '{config['username']}' not found"
+                )
+                continue
+            shard_configs[gym_id % processes].append(config)
+
+        self._shards = [
+            _Shard(index, shard) for index, shard in enumerate(shard_configs) if shard
+        ]
+        self._states: typing.Dict[StateKey, ShiftState] = {}
+        self._updates: typing.List[StateKey] = []
+        self._sequence = 0
+
+    def start(self, timeout: float = START_TIMEOUT) -> bool:
+        """ Start the workers, returns true if all of them logged in."""
+        for shard in self._shards:
+            parent_conn, child_conn = self._context.Pipe()
+            shard.conn = parent_conn
+            shard.process = self._context.Process(
+                target=_run_shard,
+                args=(shard.configs, self._url, self._transport_options, child_conn),
+                name=f"Shard-{shard.index}",
+                daemon=True,
+            )
+            shard.process.start()
+            child_conn.close()
+
+        logged_in = True
+        for shard in self._shards:
+            message = shard.receive(0, timeout)
+            if message is None:
+                shard.failed("No answer after the start")
+                logged_in = False
+            elif not message[1]:
+                shard.failed("Login failed")
+                logged_in = False
+        self._publish_health()
+        return logged_in
+
+    def poll(self, timeout: float = POLL_TIMEOUT):
+        """ Poll all shards in parallel, and merge their updates in the state table."""
+        with metrics.REGISTRY.timed(
+            "poll_cycle_seconds", "Duration of a complete poll.", mode="sharded"
+        ):
+            self._sequence += 1
+            polling = []
+            for shard in self._shards:
+                if not shard.alive:
+                    shard.failed("Worker process is not running")
+                    continue
+                try:
+                    shard.conn.send(("poll", self._sequence))
+                except OSError as err:
+                    shard.failed(f"Could not send the poll: {err!r}")
+                    continue
+                polling.append(shard)
+
+            deadline = time.monotonic() + timeout
+            for shard in polling:
+                message = shard.receive(
+                    self._sequence, max(0.0, deadline - time.monotonic())
+                )
+                if message is None:
+                    shard.failed("No answer to the poll")
+                    continue
+                status, payload, seconds = message
+                shard.poll_seconds = seconds
+                if status == "result":
+                    shard.polls += 1
+                    self._merge(payload)
+                else:
+                    shard.failed(payload)
+        self._publish_health()
+
+    def updates(self) -> typing.Generator[
+        typing.Tuple[StateKey, ShiftState], None, None
+    ]:
+        """ The instances of which the state changed since the last call."""
+        updates, self._updates = self._updates, []
+        for key in updates:
+            yield key, self._states[key]
+
+    @property
+    def states(self) -> typing.Dict[StateKey, ShiftState]:
+        """ The last known state of every polled instance, of all shards."""
+        return self._states
+
+    def health(self) -> typing.List[ShardHealth]:
+        return [
+            ShardHealth(
+                shard.index,
+                shard.alive,
+                len(shard.configs),
+                shard.polls,
+                shard.errors,
+                shard.poll_seconds,
+                shard.last_error,
+            )
+            for shard in self._shards
+        ]
+
+    def close(self, timeout: float = 5.0):
+        """ Stop the worker processes."""
+        for shard in self._shards:
+            if shard.conn is not None:
+                try:
+                    shard.conn.send(("stop", 0))
+                except OSError:
+                    pass
+        for shard in self._shards:
+            if shard.process is not None:
+                shard.process.join(timeout)
+                if shard.process.is_alive():
+                    shard.process.terminate()
+            if shard.conn is not None:
+                shard.conn.close()
+
+    def __enter__(self) -> "ShardedPoller":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _merge(self, updates: typing.List[_Update]):
+        for username, when, area, state in updates:
+            key = (username, when, area)
+            self._states[key] = ShiftState[state]
+            self._updates.append(key)
+
+    def _publish_health(self):
+        for shard in self._shards:
+            metrics.REGISTRY.set(
+                "shard_up",
+                int(shard.alive),
+                "Whether the shard worker runs",
+                shard=shard.index,
+            )
+            metrics.REGISTRY.set(
+                "shard_poll_seconds",
+                shard.poll_seconds,
+                "Duration of the last poll of the shard",
+                shard=shard.index,
+            )
+            metrics.REGISTRY.set(
+                "shard_errors",
+                shard.errors,
+                "Failed polls of the shard",
+                shard=shard.index,
+            )
@@ -0,0 +1,56 @@
+"""
+Index to quickly find the shift containing a certain time.
+"""
+import bisect
+import datetime
+import itertools
+import typing
+
+from .toplogger import ClimbShift
+
+
+class ShiftIndex:
+    """Shifts per area, sorted on their start time.
+    Lookups bisect on the start times, so they take logarithmic time.
+    """
+
+    def __init__(self, shifts: typing.Iterable[ClimbShift]):
+        per_area: typing.Dict[str, typing.List[ClimbShift]] = {}
+        for shift in shifts:
+            per_area.setdefault(shift.area, []).append(shift)
+
+        self._shifts: typing.Dict[str, typing.List[ClimbShift]] = {}
+        self._starts: typing.Dict[str, typing.List[datetime.datetime]] = {}
+        self._max_ends: typing.Dict[str, typing.List[datetime.datetime]] = {}
+
+        for area, area_shifts in per_area.items():
+            area_shifts.sort(key=lambda shift: shift.start)
+            self._shifts[area] = area_shifts
+            self._starts[area] = [shift.start for shift in area_shifts]
+
+            # The latest end time up to each shift, to deal with overlapping shifts.
+            self._max_ends[area] = list(
+                itertools.accumulate((shift.end for shift in area_shifts), max)
+            )
+
+    def find(
+        self, time_inst: datetime.datetime, area: typing.Optional[str]
+    ) -> typing.Optional[ClimbShift]:
+        """ The shift in the area which contains the given time, None if there is none."""
+        if area not in self._shifts:
+            return None
+
+        shifts = self._shifts[area]
+        max_ends = self._max_ends[area]
+        # The last shift that starts at or before the given time.
+        idx = bisect.bisect_right(self._starts[area], time_inst) - 1
+
+        # Only overlapping shifts make us look further back.
+        while idx >= 0 and max_ends[idx] > time_inst:
+            if shifts[idx].is_in(time_inst):
+                return shifts[idx]
+            idx -= 1
+        return None
+
+    def __len__(self) -> int:
+        return sum(len(shifts) for shifts in self._shifts.values())
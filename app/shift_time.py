@@ -1,7 +1,17 @@
 """
 Time handling for the sniper.
 """
+import array
+import bisect
 import datetime
+import itertools
+import re
+import typing
+
+# A time of the day, with an optional am/pm suffix.
+_TIME_RE = re.compile(r"(\d{1,2})\s*:\s*(\d{2})\s*([ap]m)?", re.IGNORECASE)
+# Minutes of the day of 23:59, used for 12:00 AM.
+_END_OF_DAY = 23 * 60 + 59
 
 
 def __convert_am_pm(time: datetime.time, am_pm: str) -> datetime.time:
@@ -30,7 +40,7 @@ def time_conversion(input_time: str) -> datetime.time:
         minute = minute[:-2]
 
         time = datetime.time(int(hour), int(minute))
-        __convert_am_pm(time, am_pm)
+        time = __convert_am_pm(time, am_pm)
     else:
         time = datetime.time(int(hour), int(minute))
 
@@ -52,3 +62,83 @@ class ShiftTime:
 
     def __str__(self) -> str:
         return f"{self._start_time} - {self._end_time}"
+
+
+def _minutes(text: str) -> int:
+    """ Minutes of the day of a time string, with the am/pm rules of time_conversion."""
+    match = _TIME_RE.search(text)
+    if match is None:
+        raise ValueError(f"Invalid time: '{text}'")
+    hour, minute, am_pm = match.groups(default="")
+    hours, minutes = int(hour), int(minute)
+    am_pm = am_pm.lower()
+    if am_pm == "am" and hours == 12 and minutes == 0:
+        return _END_OF_DAY
+    if am_pm == "pm" and hours != 12:
+        hours += 12
+    return hours * 60 + minutes
+
+
+class ShiftTable:
+    """The shifts of a day page, as columns of start and end minutes of the day.
+    Matching a time is a bisect on the sorted starts, instead of a loop over shifts.
+    """
+
+    def __init__(self, starts: typing.Iterable[int], ends: typing.Iterable[int]):
+        self._starts = array.array("H", starts)
+        self._ends = array.array("H", ends)
+        if len(self._starts) != len(self._ends):
+            raise ValueError("Every shift needs a start and an end time")
+
+        # Page indices ordered on start, with their starts and the running max end.
+        self._order = array.array(
+            "H", sorted(range(len(self._starts)), key=self._starts.__getitem__)
+        )
+        self._sorted_starts = array.array("H", (self._starts[i] for i in self._order))
+        self._max_ends = array.array(
+            "H",
+            itertools.accumulate((self._ends[i] for i in self._order), max),
+        )
+
+    @classmethod
+    def from_timespecs(
+        cls, timespecs: typing.Iterable[str], split: str = "-"
+    ) -> "ShiftTable":
+        """ Parse all 'start <split> end' strings of a page."""
+        starts = []
+        ends = []
+        for timespec in timespecs:
+            start, end = timespec.split(split)
+            starts.append(_minutes(start))
+            ends.append(_minutes(end))
+        return cls(starts, ends)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def find(self, rel_time: datetime.time) -> typing.Optional[int]:
+        """The page index of the first shift the time is in, or None.
+        Like ShiftTime.is_time_in_shift, the start is included and the end is not.
+        """
+        minute = rel_time.hour * 60 + rel_time.minute
+        found = None
+        idx = bisect.bisect_right(self._sorted_starts, minute) - 1
+        # Walk back over the shifts that start earlier, while one can still overlap.
+        while idx >= 0 and self._max_ends[idx] > minute:
+            page_idx = self._order[idx]
+            if self._ends[page_idx] > minute and (found is None or page_idx < found):
+                found = page_idx
+            idx -= 1
+        return found
+
+    def find_all(
+        self, times: typing.Iterable[datetime.time]
+    ) -> typing.List[typing.Optional[int]]:
+        """ The page index of the shift of every time, see find."""
+        return [self.find(rel_time) for rel_time in times]
+
+    def __str__(self) -> str:
+        return ", ".join(
+            f"{start // 60:02d}:{start % 60:02d} - {end // 60:02d}:{end % 60:02d}"
+            for start, end in zip(self._starts, self._ends)
+        )
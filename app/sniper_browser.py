@@ -1,38 +1,116 @@
 """
 The sniper class for the Toplogger webapp.
 """
-import typing
+import abc
 import calendar
+import contextlib
+import itertools
+import queue
+import threading
 import time
+import typing
 from functools import wraps
 
-import webbot
-from . import shift_time, schedule
+from . import metrics, shift_time, schedule
+from .poll import poll_instances
+from .toplogger import ToploggerApi
 
 _TIMESPLIT = "—"
-_PRINT_TIMING = False
+
+# How long to wait (in seconds) for the webapp to show an element.
+_WAIT_TIMEOUT = 5.0
+_WAIT_INTERVAL = 0.05
+
+# Scrape the first line of the shift times, and the booking buttons in one go.
+_SCRAPE_DAY_JS = """
+const times = Array.from(document.querySelectorAll("div, span"))
+    .filter(e => e.childElementCount === 0)
+    .filter(e => e.innerText.includes(" " + arguments[0] + " "))
+    .map(e => e.innerText.split("\\n")[0]);
+const buttons = Array.from(document.querySelectorAll("button"))
+    .map(e => e.innerText.trim())
+    .filter(text => text.toLowerCase().includes("ook"));
+return [times, buttons];
+"""
+
+_BUTTON_STATES = {
+    "BOOK": schedule.ShiftState.AVAILABLE,
+    "FULLY BOOKED": schedule.ShiftState.FULL,
+    # We've already taken this slot
+    "CANCEL BOOKING": schedule.ShiftState.TAKEN,
+}
 
 
 def timeit(method: typing.Callable):
-    """ Time a method."""
+    """ Time a method, in the sniper_step_seconds histogram."""
 
     @wraps(method)
     def timed(*args, **kwargs):
-        tic = time.perf_counter()
-        ret_val = method(*args, **kwargs)
-        toc = time.perf_counter()
-
-        if _PRINT_TIMING:
-            print(f"{method.__name__} took: {toc - tic:.4} seconds")
-        return ret_val
+        with metrics.REGISTRY.timed(
+            "sniper_step_seconds",
+            "Duration of the sniper steps.",
+            method=method.__qualname__,
+        ):
+            return method(*args, **kwargs)
 
     return timed
 
 
-class ToploggerSniper:
-    """ The sniper class."""
+def _wait_for(
+    condition: typing.Callable[[], bool], timeout: float = _WAIT_TIMEOUT
+) -> bool:
+    """ Wait till the condition holds, returns false if it timed out."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(_WAIT_INTERVAL)
+    return True
+
+
+class ShiftStateBackend(abc.ABC):
+    """ A way to determine the state of the shifts."""
+
+    @abc.abstractmethod
+    def update_shift_state(self, sched_inst: schedule.ScheduleInstance):
+        """ Update the shift state of the given schedule instance."""
+
+    def update_shift_states(self, instances: typing.List[schedule.ScheduleInstance]):
+        """ Update the shift states of all given schedule instances."""
+        for sched_inst in instances:
+            self.update_shift_state(sched_inst)
+
+
+class ApiBackend(ShiftStateBackend):
+    """ Determine the shift states with the Toplogger api."""
+
+    def __init__(
+        self,
+        username: str = "",
+        password: str = "",
+        gym: str = "",
+        api: typing.Optional[ToploggerApi] = None,
+    ):
+        self._api = api if api is not None else ToploggerApi()
+        if username and not self._api.logged_in:
+            self._api.login(username, password)
+        if gym and not self._api.gym_id_set:
+            self._api.pick_gym(gym)
+
+    def update_shift_state(self, sched_inst: schedule.ScheduleInstance):
+        self.update_shift_states([sched_inst])
+
+    @timeit
+    def update_shift_states(self, instances: typing.List[schedule.ScheduleInstance]):
+        poll_instances(self._api, instances)
+
+
+class BrowserPage:
+    """ A single logged in page of the webapp."""
 
     def __init__(self, username: str = "", password: str = "", gym: str = ""):
+        import webbot  # pylint: disable=import-outside-toplevel
+
         self.__browser: webbot.Browser = webbot.Browser(showWindow=False)
         self.__browser.go_to("https://app.toplogger.nu")
 
@@ -50,9 +128,9 @@ class ToploggerSniper:
         self.__browser.click("Select Gym")
 
         # Now wait till gyms loaded
-        time.sleep(0.5)
+        _wait_for(lambda: self.__browser.exists(self.__gym))
         self.__browser.click(self.__gym)
-        time.sleep(0.5)
+        _wait_for(lambda: self.__browser.exists("SELECT GYM"))
         # TODO: How to check that the gym is available / chosen
         self.__browser.click("SELECT GYM")
 
@@ -95,11 +173,12 @@ class ToploggerSniper:
         self.__browser.click("SIGN IN")
         # TODO: How to check if the login was succesfull?
 
-        # sleep till page is loaded
-        # TODO: We should use some condition to wait till some webelement is present.
-        time.sleep(2.0)
+        # Wait till the sign in form is gone, and the page is loaded again.
+        _wait_for(lambda: not self.__browser.exists("SIGN IN", tag="button"))
         self._check_login()
-        time.sleep(0.5)
+        _wait_for(
+            lambda: self.__browser.exists(tag="div", classname="v-toolbar__title")
+        )
 
     @timeit
     def _goto_reservations(self, area: str = None):
@@ -112,7 +191,11 @@ class ToploggerSniper:
             # Now we navigate to the reservations page
             self.__browser.click(classname="v-input__slot")
             self.__browser.click("Reservations")
-            time.sleep(0.5)
+            _wait_for(
+                lambda: self.__browser.exists(
+                    "Select your area", tag="div", classname="v-input__slot"
+                )
+            )
 
         # Now select the area (if applicable)
         if area is not None:
@@ -139,21 +222,23 @@ class ToploggerSniper:
 
         if not (month_elem and month_elem[0].text.startswith(month_name)):
             self.__browser.click(tag="div", classname="v-date-picker-header")
-            time.sleep(0.1)
+            _wait_for(lambda: self.__browser.exists(month_name, tag="div"))
             self.__browser.click(month_name, tag="div")
-            time.sleep(0.1)
+            _wait_for(
+                lambda: self.__browser.exists(str(day), tag="div", loose_match=False)
+            )
         self.__browser.click(str(day), tag="div", loose_match=False)
 
     @timeit
-    def _find_shifts(self) -> typing.List[shift_time.ShiftTime]:
-        # Let's get all the time elements
-        shifts = []
-        for shift in self.__browser.find_elements(" " + _TIMESPLIT + " "):
-            # Only use the first line
-            timespec = shift.text.splitlines()[0]
-            start, end = timespec.split(_TIMESPLIT)
-            shifts.append(shift_time.ShiftTime(start, end))
-        return shifts
+    def _find_shifts(self) -> shift_time.ShiftTable:
+        # Let's get all the time elements, and only use their first line
+        return shift_time.ShiftTable.from_timespecs(
+            (
+                shift.text.splitlines()[0]
+                for shift in self.__browser.find_elements(" " + _TIMESPLIT + " ")
+            ),
+            _TIMESPLIT,
+        )
 
     @timeit
     def _find_shift_states(self) -> typing.List[schedule.ShiftState]:
@@ -162,19 +247,27 @@ class ToploggerSniper:
         for book_string in self.__browser.find_elements(
             "ook", tag="button", loose_match=False
         ):
-            if book_string.text == "BOOK":
-                states.append(schedule.ShiftState.AVAILABLE)
-            elif book_string.text == "FULLY BOOKED":
-                states.append(schedule.ShiftState.FULL)
-            elif book_string.text == "CANCEL BOOKING":
-                # We've already taken this slot
-                states.append(schedule.ShiftState.TAKEN)
-            else:
-                print(f"UNKNOWN!! '{book_string.text}''")
-                states.append(schedule.ShiftState.UNKNOWN)
+            states.append(self._button_state(book_string.text))
 
         return states
 
+    @timeit
+    def _scrape_day(
+        self,
+    ) -> typing.Tuple[shift_time.ShiftTable, typing.List[schedule.ShiftState]]:
+        """ The shifts and their states of the current day, with a single query."""
+        timespecs, buttons = self.__browser.driver.execute_script(
+            _SCRAPE_DAY_JS, _TIMESPLIT
+        )
+        shifts = shift_time.ShiftTable.from_timespecs(timespecs, _TIMESPLIT)
+        return shifts, [self._button_state(text) for text in buttons]
+
+    @staticmethod
+    def _button_state(text: str) -> schedule.ShiftState:
+        if text not in _BUTTON_STATES:
+            print(f"UNKNOWN!! '{text}''")
+        return _BUTTON_STATES.get(text, schedule.ShiftState.UNKNOWN)
+
     def update_shift_state(self, sched_inst: schedule.ScheduleInstance):
         """ Update the shift state of the given schedule instance."""
         # Should we check whether we're still logged in? / gym chosen
@@ -183,16 +276,136 @@ class ToploggerSniper:
 
         shifts = self._find_shifts()
         states = self._find_shift_states()
-
+        self._assign_states([sched_inst], shifts, states)
+
+    def update_shift_states(self, instances: typing.List[schedule.ScheduleInstance]):
+        """Update the shift states of the given schedule instances.
+        Every area and day is only visited and scraped once.
+        """
+        ordered = sorted(instances, key=lambda inst: (inst.area or "", inst.time))
+        for _, day_instances in itertools.groupby(
+            ordered, key=lambda inst: (inst.area, inst.time.date())
+        ):
+            day_instances = list(day_instances)
+            first = day_instances[0]
+            self._goto_reservations(first.area)
+            self._goto_day(first.time.month, first.time.day)
+
+            shifts, states = self._scrape_day()
+            self._assign_states(day_instances, shifts, states)
+
+    @staticmethod
+    def _assign_states(
+        instances: typing.List[schedule.ScheduleInstance],
+        shifts: shift_time.ShiftTable,
+        states: typing.List[schedule.ShiftState],
+    ):
         if len(shifts) != len(states):
             print(
                 f"Unexpected unequal amount of bookings {len(shifts)} vs {len(states)}"
             )
 
-        for state, shift in zip(states, shifts):
-            if shift.is_time_in_shift(sched_inst.time.time()):
-                sched_inst.state = state
-                break
-        else:
-            # There is no shift for the configured time
-            sched_inst.state = schedule.ShiftState.UNKNOWN
+        matches = shifts.find_all(inst.time.time() for inst in instances)
+        for sched_inst, idx in zip(instances, matches):
+            if idx is not None and idx < len(states):
+                sched_inst.state = states[idx]
+            else:
+                # There is no shift for the configured time
+                sched_inst.state = schedule.ShiftState.UNKNOWN
+
+
+class PagePool:
+    """ Logged in browser pages, which are reused instead of started per check."""
+
+    def __init__(
+        self, username: str = "", password: str = "", gym: str = "", size: int = 1
+    ):
+        self.__usr = username
+        self.__pwd = password
+        self.__gym = gym
+        self._size = size
+        self._created = 0
+        self._lock = threading.Lock()
+        self._pages: "queue.Queue[BrowserPage]" = queue.Queue()
+
+    @contextlib.contextmanager
+    def page(self) -> typing.Generator[BrowserPage, None, None]:
+        """ Borrow a page, a new one is only started if all pages are in use."""
+        with self._lock:
+            start_page = self._pages.empty() and self._created < self._size
+            if start_page:
+                self._created += 1
+
+        page = (
+            BrowserPage(self.__usr, self.__pwd, self.__gym)
+            if start_page
+            else self._pages.get()
+        )
+        try:
+            yield page
+        finally:
+            self._pages.put(page)
+
+
+class BrowserBackend(ShiftStateBackend):
+    """ Determine the shift states by scraping the webapp."""
+
+    def __init__(
+        self, username: str = "", password: str = "", gym: str = "", pages: int = 1
+    ):
+        self._pool = PagePool(username, password, gym, pages)
+
+    @timeit
+    def update_shift_state(self, sched_inst: schedule.ScheduleInstance):
+        with self._pool.page() as page:
+            page.update_shift_state(sched_inst)
+
+    @timeit
+    def update_shift_states(self, instances: typing.List[schedule.ScheduleInstance]):
+        with self._pool.page() as page:
+            page.update_shift_states(instances)
+
+
+class ToploggerSniper:
+    """The sniper class.
+    By default the shift states are obtained from the api, the browser is a fallback.
+    """
+
+    def __init__(
+        self,
+        username: str = "",
+        password: str = "",
+        gym: str = "",
+        backend: typing.Optional[ShiftStateBackend] = None,
+        use_browser: bool = False,
+    ):
+        if backend is None:
+            if use_browser:
+                backend = BrowserBackend(username, password, gym)
+            else:
+                backend = ApiBackend(username, password, gym)
+        self._backend = backend
+
+    @property
+    def backend(self) -> ShiftStateBackend:
+        return self._backend
+
+    def update_shift_state(self, sched_inst: schedule.ScheduleInstance):
+        """ Update the shift state of the given schedule instance."""
+        self._backend.update_shift_state(sched_inst)
+
+    def update_shift_states(
+        self, instances: typing.Iterable[schedule.ScheduleInstance]
+    ):
+        """ Update the shift states of the given schedule instances in one pass."""
+        instances = list(instances)
+        tic = time.perf_counter()
+        self._backend.update_shift_states(instances)
+        toc = time.perf_counter()
+
+        if instances:
+            metrics.REGISTRY.observe(
+                "sniper_instance_seconds",
+                (toc - tic) / len(instances),
+                "Duration of a state check, per schedule instance.",
+            )
@@ -0,0 +1,162 @@
+"""
+Persistent state of the sniper, so a restart does not start from scratch.
+"""
+import datetime
+import sqlite3
+import threading
+import time
+import typing
+
+from .schedule import ScheduleInstance, ShiftState
+from .toplogger import ToploggerApi
+
+STATE_FILE = "sniper_state.sqlite"
+
+# How long (in seconds) the stored data is trusted.
+TOKEN_MAX_AGE = 24 * 3600.0
+GYM_MAX_AGE = 7 * 24 * 3600.0
+
+StateKey = typing.Tuple[datetime.datetime, typing.Optional[str]]
+
+_TABLES = """
+CREATE TABLE IF NOT EXISTS tokens (
+    url TEXT, email TEXT, token TEXT, saved REAL, PRIMARY KEY (url, email)
+);
+CREATE TABLE IF NOT EXISTS gyms (
+    url TEXT, name TEXT, gym_id INTEGER, saved REAL, PRIMARY KEY (url, name)
+);
+CREATE TABLE IF NOT EXISTS areas (
+    url TEXT, gym_id INTEGER, name TEXT, area_id INTEGER, saved REAL,
+    PRIMARY KEY (url, gym_id, name)
+);
+CREATE TABLE IF NOT EXISTS instance_states (
+    gym TEXT, time TEXT, area TEXT, state TEXT, PRIMARY KEY (gym, time, area)
+);
+"""
+
+
+class StateStore:
+    """ SQLite store of the login token, gym and area ids and the instance states."""
+
+    def __init__(
+        self,
+        path: str = STATE_FILE,
+        token_max_age: float = TOKEN_MAX_AGE,
+        gym_max_age: float = GYM_MAX_AGE,
+    ):
+        self._token_max_age = token_max_age
+        self._gym_max_age = gym_max_age
+        # The poll thread saves the states, so the connection is shared between threads.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(_TABLES)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def restore_api(
+        self,
+        api: ToploggerApi,
+        username: str,
+        gym: str,
+        password: typing.Optional[str] = None,
+    ) -> typing.Tuple[bool, bool]:
+        """Restore the login and the gym of the api from the store.
+        With the password the api can login again once the stored token expires.
+        Returns whether the login and the gym could be restored.
+        """
+        now = time.time()
+        with self._lock:
+            token_row = self._conn.execute(
+                "SELECT token, saved FROM tokens "
+                "WHERE url = ? AND email = ? AND saved > ?",
+                (api.url, username, now - self._token_max_age),
+            ).fetchone()
+            gym_row = self._conn.execute(
+                "SELECT gym_id FROM gyms WHERE url = ? AND name = ? AND saved > ?",
+                (api.url, gym.lower(), now - self._gym_max_age),
+            ).fetchone()
+            area_rows = []
+            if gym_row is not None:
+                area_rows = self._conn.execute(
+                    "SELECT name, area_id FROM areas "
+                    "WHERE url = ? AND gym_id = ? AND saved > ?",
+                    (api.url, gym_row[0], now - self._gym_max_age),
+                ).fetchall()
+
+        if token_row is not None:
+            api.restore_login(
+                username, token_row[0], password, max(0.0, now - token_row[1])
+            )
+        if gym_row is not None:
+            api.restore_gym(gym_row[0], dict(area_rows) if area_rows else None)
+        return token_row is not None, gym_row is not None
+
+    def save_token(self, url: str, email: str, token: str):
+        """ Store the login token of an account."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?)",
+                (url, email, token, time.time()),
+            )
+
+    def watch_api(self, api: ToploggerApi):
+        """ Store the new token of every re-login and background refresh of the api."""
+        api.on_token_change(
+            lambda email, token: self.save_token(api.url, email, token)
+        )
+
+    def save_api(self, api: ToploggerApi, gym: str):
+        """ Store the login and the gym of the api."""
+        if api.email and api.token:
+            self.save_token(api.url, api.email, api.token)
+        now = time.time()
+        with self._lock, self._conn:
+            if api.gym_id is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO gyms VALUES (?, ?, ?, ?)",
+                    (api.url, gym.lower(), api.gym_id, now),
+                )
+                self._conn.execute(
+                    "DELETE FROM areas WHERE url = ? AND gym_id = ?",
+                    (api.url, api.gym_id),
+                )
+                self._conn.executemany(
+                    "INSERT INTO areas VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (api.url, api.gym_id, name, area_id, now)
+                        for name, area_id in api.area_ids.items()
+                    ],
+                )
+
+    def load_states(self, gym: str) -> typing.Dict[StateKey, ShiftState]:
+        """ The last known states of the schedule instances of a gym."""
+        now = datetime.datetime.now()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT time, area, state FROM instance_states "
+                "WHERE gym = ? AND time >= ?",
+                (gym, now.isoformat()),
+            ).fetchall()
+        return {
+            (datetime.datetime.fromisoformat(when), area or None): ShiftState[state]
+            for when, area, state in rows
+        }
+
+    def save_states(self, gym: str, instances: typing.Iterable[ScheduleInstance]):
+        """ Store the states of the schedule instances, and forget the passed ones."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM instance_states WHERE gym = ? AND time < ?",
+                (gym, datetime.datetime.now().isoformat()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO instance_states VALUES (?, ?, ?, ?)",
+                [
+                    (gym, inst.time.isoformat(), inst.area or "", inst.state.name)
+                    for inst in instances
+                    if inst.state != ShiftState.UNKNOWN
+                ],
+            )
@@ -1,51 +1,110 @@
 import requests
 import typing
+import bisect
+import concurrent.futures
 import enum
+import functools
 import logging
 import datetime
+import time
+import weakref
 from collections import namedtuple
 
 from requests import api
 from requests.models import encode_multipart_formdata
 
+from . import metrics
+from .area_cache import AREA_CACHE_TTL, AreaCache
+from .auth import AuthManager, TokenListener
+from .json_stream import iter_json_array
+from .gym_directory import GymDirectory
+from .response_cache import ResponseCache
+from .schedule import ScheduleInstance
+from .transport import resilient_session
+
 URL = "https://api.toplogger.nu"
+# Concurrent requests of a bulk fetch of the shifts.
+MAX_CONCURRENCY = 8
+# Size (in bytes) of the chunks in which streamed responses are read.
+STREAM_CHUNK_SIZE = 16 * 1024
 
 _LOGGER = logging.getLogger(__name__)
 
+# Shifts are grouped per day and area name.
+ShiftKey = typing.Tuple[datetime.date, str]
+
+# A booking request that only lacks the slot to book.
+PreparedBooking = namedtuple("PreparedBooking", ["request", "area_id"])
+
+# Called with the shifts of a (date, area) and the time they came in.
+FetchedCallback = typing.Callable[[ShiftKey, typing.List["ClimbShift"], float], None]
+
 
 class _ApiPath(enum.Enum):
-    LOGIN = URL + "/users/sign_in.json"
-    RESERVATIONS = URL + "/v1/gyms/{}/reservations"
-    ALL_GYMS = URL + "/v1/gyms"
-    SHIFTS = URL + "/v1/gyms/{}/slots"
-    AREAS = URL + "/v1/gyms/{}/reservation_areas"
+    LOGIN = "/users/sign_in.json"
+    RESERVATIONS = "/v1/gyms/{}/reservations"
+    ALL_GYMS = "/v1/gyms"
+    SHIFTS = "/v1/gyms/{}/slots"
+    AREAS = "/v1/gyms/{}/reservation_areas"
+
+    def url(self, base_url: str, *args) -> str:
+        """ The full url of this path on the given api server."""
+        return base_url + self.value.format(*args)
 
 
+@functools.lru_cache(maxsize=4096)
 def get_datetime(string_input: str) -> datetime.datetime:
-    """ Convert a string to datetime. Note that for now all timezone info is stripped off."""
-    # TODO Handle timezones?
-    # We simply use only the date + HH:MM time spec.
-    date_str = string_input.split(".", 2)[0]
-    return datetime.datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
+    """Convert an ISO 8601 string to a naive datetime, in the wall clock time of the gym.
+    The timezone offset is dropped without converting, so the result does not
+    depend on the timezone of the host.
+    """
+    # Older python versions do not understand the Z suffix.
+    if string_input.endswith("Z"):
+        string_input = string_input[:-1] + "+00:00"
+    parsed = datetime.datetime.fromisoformat(string_input)
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None)
+    return parsed
 
 
 class ClimbShift:
+    __slots__ = ("_area", "_start", "_end", "_slot_id", "__weakref__")
+
     def __init__(self, json_req: dict, area=""):
         # TODO: Some handling if values are not available?
-        self._area = area
-        if "start_at" in json_req:
-            self._start = get_datetime(json_req["start_at"])
-        else:
-            self._start = get_datetime(json_req["slot_start_at"])
-
+        start, end, self._area, self._slot_id = self._json_key(json_req, area)
+        self._start = get_datetime(start)
+        self._end = get_datetime(end)
+
+    @classmethod
+    def from_json(cls, json_req: dict, area="") -> "ClimbShift":
+        """Get the shift of the json data.
+        Shifts that are still alive from an earlier poll are reused instead of parsed.
+        """
+        key = cls._json_key(json_req, area)
+        shift = _SHIFT_CACHE.get(key)
+        if shift is None:
+            shift = cls(json_req, area)
+            _SHIFT_CACHE[key] = shift
+        return shift
+
+    @staticmethod
+    def _json_key(
+        json_req: dict, area: str
+    ) -> typing.Tuple[str, str, str, typing.Optional[int]]:
+        """ The raw start, end, area and slot id of the json data."""
         if "start_at" in json_req:
-            self._end = get_datetime(json_req["end_at"])
+            start, end = json_req["start_at"], json_req["end_at"]
         else:
-            self._end = get_datetime(json_req["slot_end_at"])
+            start, end = json_req["slot_start_at"], json_req["slot_end_at"]
 
         # If possible we determine the area from the json data
         if "reservation_area" in json_req:
-            self._area = json_req["reservation_area"]["name"]
+            area = json_req["reservation_area"]["name"]
+        # Reservations refer to their slot, a slot itself only has an id.
+        slot_id = json_req.get("slot_id", json_req.get("id"))
+        return start, end, area, slot_id
 
     def is_in(self, time_inst: datetime.datetime) -> bool:
         return self._start <= time_inst and self._end > time_inst
@@ -54,105 +113,423 @@ class ClimbShift:
     def area(self) -> str:
         return self._area
 
+    @property
+    def start(self) -> datetime.datetime:
+        return self._start
+
+    @property
+    def end(self) -> datetime.datetime:
+        return self._end
+
+    @property
+    def slot_id(self) -> typing.Optional[int]:
+        return self._slot_id
+
     def __str__(self) -> str:
         return f"Climbshift at {self._area} on {self._start:%A %d %B} from {self._start:%H:%M} till {self._end:%H:%M}"
 
 
+# Interned shifts, they are dropped once nothing refers to them anymore.
+_SHIFT_CACHE: "weakref.WeakValueDictionary[typing.Tuple, ClimbShift]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def _shifts_payload(
+    date: datetime.date, area_id: typing.Optional[int] = None
+) -> typing.Dict[str, typing.Any]:
+    """ The query parameters to get the shifts of a single day."""
+    # TODO: We should find the mapping reservation_id to string!
+    payload: typing.Dict[str, typing.Any] = {
+        "slim": "true",
+        "date": date.strftime("%Y-%m-%d"),
+    }
+    if area_id is not None:
+        payload["reservation_area_id"] = area_id
+    return payload
+
+
+def _parse_available(json_data: list, area: str = "") -> typing.List[ClimbShift]:
+    """ Convert the json shift list into the shifts that still have open spots."""
+    return [
+        ClimbShift.from_json(shift, area)
+        for shift in json_data
+        if shift["spots_booked"] < shift["spots"]
+    ]
+
+
+def _parse_areas(json_data: list) -> typing.Dict[str, int]:
+    """ Convert the json area list into a mapping of lowercase area name to id."""
+    return {area["name"].lower(): area["id"] for area in json_data}
+
+
 class ToploggerApi:
-    def __init__(self):
+    def __init__(
+        self,
+        area_cache_ttl: float = AREA_CACHE_TTL,
+        url: str = URL,
+        response_cache: typing.Optional[ResponseCache] = None,
+        session: typing.Optional[requests.Session] = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+    ):
+        self._url = url
         self._gym_id: typing.Optional[int] = None
-        self._email: typing.Optional[str] = None
-        self._token: typing.Optional[str] = None
-        self._session = requests.Session()
-
-    def login(self, username: str, password: str) -> bool:
-        # First let's try to login
-        r = self._session.post(
-            _ApiPath.LOGIN.value,
-            json={"user": {"email": username, "password": password}},
-        )
+        self._session = session if session is not None else resilient_session()
+        self._auth = AuthManager(self._session, _ApiPath.LOGIN.url(self._url))
+        self._cache = response_cache if response_cache is not None else ResponseCache()
 
-        if r.status_code != 200:
-            return False
+        # The area ids of the current gym.
+        self._areas = AreaCache(area_cache_ttl)
+        self._max_concurrency = max_concurrency
 
-        # We can save the username, and autorization token.
-        self._email = username
-        self._token = r.json()["authentication_token"]
-        # TODO: If we save the password, we could login if the token expires.
-        return True
+    def login(self, username: str, password: str) -> bool:
+        # The credentials are kept, to login again once the token expires.
+        return self._auth.login(username, password)
+
+    def restore_login(
+        self,
+        username: str,
+        token: str,
+        password: typing.Optional[str] = None,
+        age: float = 0.0,
+    ):
+        """Use a token of an earlier login, instead of logging in again.
+        With the password we can still login again once the token expires.
+        The age (in seconds) of the token decides when it is refreshed.
+        """
+        self._auth.restore(username, token, password, age)
+
+    def on_token_change(self, listener: typing.Optional[TokenListener]):
+        """ Call the listener with the email and token after every (re-)login."""
+        self._auth.on_token = listener
+
+    def restore_gym(
+        self, gym_id: int, area_ids: typing.Optional[typing.Dict[str, int]] = None
+    ):
+        """ Use a gym (and its areas) found earlier, instead of looking it up again."""
+        self._gym_id = gym_id
+        # The response cache can be shared with the accounts of the same gym, so
+        # only the areas of this api are dropped.
+        self._areas.clear()
+        if area_ids is not None:
+            self._areas.set(area_ids)
 
     def pick_gym(self, gym: str) -> bool:
         """Which gym should we check?.
         returns true if the gym is valid.
         """
-        r = self._session.get(_ApiPath.ALL_GYMS.value)
-        json_data = r.json()
+        directory = GymDirectory.shared(
+            _ApiPath.ALL_GYMS.url(self._url), self._session
+        )
+        gym_id = directory.lookup(gym)
+        if gym_id is None:
+            return False
 
-        for gym_inst in json_data:
-            if gym_inst["name"].lower() == gym.lower():
-                self._gym_id = gym_inst["id"]
-                return True
-        return False
+        self._gym_id = gym_id
+        self._areas.clear()
+        self.refresh_areas()
+        return True
 
-    def get_reservations(self) -> typing.List[ClimbShift]:
-        if self._gym_id is None or self._token is None:
+    def get_reservations(self) -> typing.Optional[typing.List[ClimbShift]]:
+        """ The reservations of the account, None if they could not be fetched."""
+        if self._gym_id is None or self._auth.token is None:
             return []
 
-        r = self._session.get(
-            _ApiPath.RESERVATIONS.value.format(self._gym_id), headers=self.auth_header
+        try:
+            return self._get(
+                _ApiPath.RESERVATIONS,
+                self._gym_id,
+                parse=lambda json_data: [
+                    ClimbShift.from_json(data) for data in json_data
+                ],
+                headers=self.auth_header,
+            )
+        except requests.RequestException as err:
+            _LOGGER.warning(f"Fetching the reservations failed: {err}")
+            return None
+
+    def refresh_areas(self) -> bool:
+        """ Fetch all reservation areas of the gym in one go and cache them."""
+        if self._gym_id is None:
+            _LOGGER.warn("The gym idea should be set!")
+            return False
+        area_ids = self._get(
+            _ApiPath.AREAS,
+            self._gym_id,
+            parse=_parse_areas,
         )
+        if area_ids is None:
+            return False
+
+        self._areas.set(area_ids)
+        return True
 
-        return [ClimbShift(data) for data in r.json()]
+    def invalidate_area_cache(self):
+        """ Drop the cached areas, the next lookup will fetch them again."""
+        self._areas.clear()
+        if self._gym_id is not None:
+            self._cache.invalidate(_ApiPath.AREAS.url(self._url, self._gym_id))
 
     def get_area_id(self, area: str) -> typing.Optional[int]:
         if self._gym_id is None:
             _LOGGER.warn("The gym idea should be set!")
             return None
-        r = self._session.get(_ApiPath.AREAS.value.format(self._gym_id))
 
-        for check_area in r.json():
-            if check_area["name"].lower() == area.lower():
-                return check_area["id"]
-
-        return None
+        if self._areas.needs_refresh():
+            self.refresh_areas()
+        return self._areas.get(area)
 
     def get_available_shifts(
         self, date: datetime.date, area: str = ""
     ) -> typing.List[ClimbShift]:
         """ Get the shifts with open spots on a certain day."""
-        if self._gym_id is None:
+        try:
+            return self._get_available(date, area) or []
+        except requests.RequestException as err:
+            _LOGGER.warning(f"Fetching the shifts of {date} {area} failed: {err}")
             return []
 
-        # TODO: We should find the mapping reservation_id to string!
-        payload: typing.Dict[str, typing.Any] = {
-            "slim": "true",
-            "date": date.strftime("%Y-%m-%d"),
-        }
+    def _get_available(
+        self, date: datetime.date, area: str
+    ) -> typing.Optional[typing.List[ClimbShift]]:
+        """ The shifts with open spots through the response cache, None if that failed."""
+        if self._gym_id is None:
+            return []
 
+        id = None
         if area:
             # Let's try to find the correct area.
             id = self.get_area_id(area)
             if id is None:
                 _LOGGER.warn(f"Area '{area}' could not be found")
-            else:
-                payload["reservation_area_id"] = id
 
-        r = self._session.get(
-            _ApiPath.SHIFTS.value.format(self._gym_id), params=payload
+        return self._get(
+            _ApiPath.SHIFTS,
+            self._gym_id,
+            parse=lambda json_data: _parse_available(json_data, area),
+            params=_shifts_payload(date, id),
+        )
+
+    def iter_available_shifts(
+        self,
+        date: datetime.date,
+        area: str = "",
+        times: typing.Optional[typing.Iterable[datetime.datetime]] = None,
+    ) -> typing.Iterator[ClimbShift]:
+        """Yield the shifts with open spots on a certain day, while the response
+        is streamed in. With times, reading stops once all of them are in a shift
+        with open spots, so the rest of the day is missing from the result.
+        The response cache is not used. Raises requests.HTTPError if the request
+        failed.
+        """
+        if self._gym_id is None:
+            return
+
+        id = None
+        if area:
+            id = self.get_area_id(area)
+            if id is None:
+                _LOGGER.warning(f"Area '{area}' could not be found")
+
+        remaining = sorted(set(times)) if times is not None else None
+        for shift in self._iter(
+            _ApiPath.SHIFTS, self._gym_id, params=_shifts_payload(date, id)
+        ):
+            if shift["spots_booked"] >= shift["spots"]:
+                continue
+            available = ClimbShift.from_json(shift, area)
+            yield available
+            if remaining is None:
+                continue
+
+            # A full shift can overlap with an open one, only an open shift
+            # settles the state of the times in it.
+            low = bisect.bisect_left(remaining, available.start)
+            high = bisect.bisect_left(remaining, available.end)
+            del remaining[low:high]
+            if not remaining:
+                return
+
+    def get_available_shifts_bulk(
+        self,
+        instances: typing.Iterable[ScheduleInstance],
+        early_stop: bool = False,
+        on_fetched: typing.Optional[FetchedCallback] = None,
+    ) -> typing.Dict[ShiftKey, typing.List[ClimbShift]]:
+        """Get the shifts with open spots for all given schedule instances.
+        Every (date, area) combination is only fetched once, and all of them in
+        parallel. The combinations that could not be fetched are left out.
+        By default whole days are fetched through the response cache. With early_stop
+        a response is only read until the times of its instances are found, the
+        result then misses the rest of the day and is no snapshot for a change feed.
+        on_fetched is called from the fetching thread as soon as a combination is
+        in, with its shifts and the perf_counter time they were parsed at.
+        """
+        times: typing.Dict[ShiftKey, typing.List[datetime.datetime]] = {}
+        for inst in instances:
+            times.setdefault((inst.time.date(), inst.area or ""), []).append(inst.time)
+
+        def fetch(key: ShiftKey) -> typing.Optional[typing.List[ClimbShift]]:
+            shifts = self._fetch_available(key, times[key] if early_stop else None)
+            if shifts is not None and on_fetched is not None:
+                on_fetched(key, shifts, time.perf_counter())
+            return shifts
+
+        if len(times) <= 1:
+            results = [fetch(key) for key in times]
+        else:
+            # Look up the areas first, so the fetches don't all refresh them.
+            for area in {area for _, area in times if area}:
+                self.get_area_id(area)
+            workers = min(self._max_concurrency, len(times))
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                results = list(executor.map(fetch, times))
+        return {
+            key: shifts for key, shifts in zip(times, results) if shifts is not None
+        }
+
+    def _fetch_available(
+        self, key: ShiftKey, times: typing.Optional[typing.List[datetime.datetime]]
+    ) -> typing.Optional[typing.List[ClimbShift]]:
+        """ The shifts of a (date, area), streamed up to the times if given."""
+        date, area = key
+        try:
+            if times is None:
+                return self._get_available(date, area)
+            return list(self.iter_available_shifts(date, area, times))
+        except (requests.RequestException, ValueError) as err:
+            _LOGGER.warning(f"Fetching the shifts of {date} {area} failed: {err}")
+            return None
+
+    def prepare_booking(self, area: str = "") -> PreparedBooking:
+        """Build the booking request for a shift in the area, up to the slot id.
+        Booking with book_prepared then only costs the request itself.
+        """
+        area_id = self.get_area_id(area) if area else None
+        request = requests.Request(
+            "POST",
+            _ApiPath.RESERVATIONS.url(self._url, self._gym_id),
+            headers=self.auth_header,
+        )
+        return PreparedBooking(self._session.prepare_request(request), area_id)
+
+    def book_prepared(self, booking: PreparedBooking, slot_id: int) -> bool:
+        """ Book the slot with a request from prepare_booking, true on success."""
+        request = booking.request.copy()
+        request.prepare_body(
+            data=None,
+            files=None,
+            json={
+                "reservation": {
+                    "slot_id": slot_id,
+                    "reservation_area_id": booking.area_id,
+                }
+            },
+        )
+
+        tic = time.perf_counter()
+        r = self._auth.send(request)
+        metrics.record_request(
+            _ApiPath.RESERVATIONS.name,
+            r.status_code,
+            time.perf_counter() - tic,
+            len(r.content),
+            "POST",
+        )
+        if r.status_code not in (200, 201):
+            _LOGGER.warning(f"Booking slot {slot_id} failed: {r.status_code}")
+            return False
+        return True
+
+    def _get(
+        self,
+        path: _ApiPath,
+        *args,
+        parse: typing.Callable[[typing.Any], typing.Any] = lambda data: data,
+        params: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> typing.Any:
+        """ Get a parsed response through the response cache, None if it failed."""
+        return self._cache.get(
+            self._auth,
+            path.name,
+            path.url(self._url, *args),
+            parse,
+            params=params,
+            headers=headers,
+        )
+
+    def _iter(
+        self,
+        path: _ApiPath,
+        *args,
+        params: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> typing.Iterator[typing.Any]:
+        """Yield the items of a json list response, while it is streamed in.
+        Raises requests.HTTPError if the server did not answer 200.
+        """
+        tic = time.perf_counter()
+        size = 0
+        r = self._auth.get(
+            path.url(self._url, *args), params=params, headers=headers, stream=True
         )
 
-        return [
-            ClimbShift(shift, area)
-            for shift in r.json()
-            if shift["spots_booked"] < shift["spots"]
-        ]
+        def chunks() -> typing.Iterator[bytes]:
+            nonlocal size
+            for chunk in r.iter_content(STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                yield chunk
+
+        try:
+            if r.status_code != 200:
+                raise requests.HTTPError(
+                    f"{path.name} answered {r.status_code}", response=r
+                )
+            yield from iter_json_array(chunks())
+        finally:
+            r.close()
+            metrics.record_request(
+                path.name, r.status_code, time.perf_counter() - tic, size
+            )
+
+    @property
+    def response_cache(self) -> ResponseCache:
+        return self._cache
 
     @property
     def auth_header(self) -> dict:
         """ The authentication header if a login has been done, otherwise an empty dict."""
-        if self._email and self._token:
-            return {"X-USER-EMAIL": self._email, "X-USER-TOKEN": self._token}
-        return {}
+        return self._auth.auth_header
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @property
+    def email(self) -> typing.Optional[str]:
+        return self._auth.email
+
+    @property
+    def token(self) -> typing.Optional[str]:
+        return self._auth.token
+
+    @property
+    def gym_id(self) -> typing.Optional[int]:
+        return self._gym_id
+
+    @property
+    def area_ids(self) -> typing.Dict[str, int]:
+        """ The cached mapping of lowercase area name to area id."""
+        return self._areas.area_ids
+
+    @property
+    def area_cache_hits(self) -> int:
+        return self._areas.hits
+
+    @property
+    def area_cache_misses(self) -> int:
+        return self._areas.misses
 
     @property
     def gym_id_set(self) -> bool:
@@ -160,4 +537,4 @@ class ToploggerApi:
 
     @property
     def logged_in(self) -> bool:
-        return self._token is not None
+        return self._auth.token is not None
@@ -0,0 +1,235 @@
+"""
+Asyncio version of the Toplogger api, fetching days and areas concurrently.
+"""
+import asyncio
+import datetime
+import logging
+import typing
+
+import aiohttp
+
+from .area_cache import AreaCache
+from .gym_directory import GymDirectory
+from .schedule import ScheduleInstance
+from .toplogger import (
+    AREA_CACHE_TTL,
+    URL,
+    ClimbShift,
+    ShiftKey,
+    _ApiPath,
+    _parse_areas,
+    _parse_available,
+    _shifts_payload,
+)
+from .transport import TIMEOUT
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = 8
+
+# The failures of a request, a missing answer or one that is not json.
+_FAILURES = (aiohttp.ClientError, asyncio.TimeoutError, ValueError)
+
+
+class AsyncToploggerApi:
+    """The async Toplogger api.
+    All requests share one connection pool, which limits the concurrent requests.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        area_cache_ttl: float = AREA_CACHE_TTL,
+        url: str = URL,
+        timeout: typing.Tuple[float, float] = TIMEOUT,
+    ):
+        self._url = url
+        self._max_concurrency = max_concurrency
+        self._timeout = aiohttp.ClientTimeout(
+            sock_connect=timeout[0], sock_read=timeout[1]
+        )
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+
+        self._gym_id: typing.Optional[int] = None
+        self._email: typing.Optional[str] = None
+        self._token: typing.Optional[str] = None
+
+        self._areas = AreaCache(area_cache_ttl)
+        self._area_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "AsyncToploggerApi":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """ The pooled http session, created on first use inside the event loop."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self._timeout
+            )
+        return self._session
+
+    async def close(self):
+        """ Close the connection pool."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def login(self, username: str, password: str) -> bool:
+        try:
+            async with self.session.post(
+                _ApiPath.LOGIN.url(self._url),
+                json={"user": {"email": username, "password": password}},
+            ) as r:
+                if r.status != 200:
+                    return False
+                json_data = await r.json()
+        except _FAILURES as err:
+            _LOGGER.warning(f"Logging in failed: {err!r}")
+            return False
+
+        self._email = username
+        self._token = json_data["authentication_token"]
+        return True
+
+    async def pick_gym(self, gym: str) -> bool:
+        """Which gym should we check?.
+        returns true if the gym is valid.
+        """
+        # The directory is shared with the sync api, and only fetches once.
+        directory = GymDirectory.shared(_ApiPath.ALL_GYMS.url(self._url))
+        gym_id = await asyncio.get_running_loop().run_in_executor(
+            None, directory.lookup, gym
+        )
+        if gym_id is None:
+            return False
+
+        self._gym_id = gym_id
+        self.invalidate_area_cache()
+        await self.refresh_areas()
+        return True
+
+    async def get_reservations(self) -> typing.Optional[typing.List[ClimbShift]]:
+        """ The reservations of the account, None if they could not be fetched."""
+        if self._gym_id is None or self._token is None:
+            return []
+
+        try:
+            async with self.session.get(
+                _ApiPath.RESERVATIONS.url(self._url, self._gym_id),
+                headers=self.auth_header,
+            ) as r:
+                if r.status != 200:
+                    return None
+                json_data = await r.json()
+        except _FAILURES as err:
+            _LOGGER.warning(f"Fetching the reservations failed: {err!r}")
+            return None
+
+        return [ClimbShift.from_json(data) for data in json_data]
+
+    async def refresh_areas(self) -> bool:
+        """ Fetch all reservation areas of the gym in one go and cache them."""
+        if self._gym_id is None:
+            _LOGGER.warning("The gym idea should be set!")
+            return False
+
+        try:
+            async with self.session.get(
+                _ApiPath.AREAS.url(self._url, self._gym_id)
+            ) as r:
+                if r.status != 200:
+                    return False
+                json_data = await r.json()
+        except _FAILURES as err:
+            _LOGGER.warning(f"Fetching the areas failed: {err!r}")
+            return False
+
+        self._areas.set(_parse_areas(json_data))
+        return True
+
+    def invalidate_area_cache(self):
+        """ Drop the cached areas, the next lookup will fetch them again."""
+        self._areas.clear()
+
+    async def get_area_id(self, area: str) -> typing.Optional[int]:
+        if self._gym_id is None:
+            _LOGGER.warning("The gym idea should be set!")
+            return None
+
+        # Concurrent lookups should wait for a single refresh.
+        async with self._area_lock:
+            if self._areas.needs_refresh():
+                await self.refresh_areas()
+
+        return self._areas.get(area)
+
+    async def get_available_shifts(
+        self, date: datetime.date, area: str = ""
+    ) -> typing.Optional[typing.List[ClimbShift]]:
+        """ Get the shifts with open spots on a certain day, None if that failed."""
+        if self._gym_id is None:
+            return []
+
+        area_id = None
+        if area:
+            area_id = await self.get_area_id(area)
+            if area_id is None:
+                _LOGGER.warning(f"Area '{area}' could not be found")
+
+        try:
+            async with self.session.get(
+                _ApiPath.SHIFTS.url(self._url, self._gym_id),
+                params=_shifts_payload(date, area_id),
+            ) as r:
+                if r.status != 200:
+                    _LOGGER.warning(f"Fetching the shifts of {date} {area} failed")
+                    return None
+                json_data = await r.json()
+        except _FAILURES as err:
+            _LOGGER.warning(f"Fetching the shifts of {date} {area} failed: {err!r}")
+            return None
+
+        return _parse_available(json_data, area)
+
+    async def get_available_shifts_bulk(
+        self, instances: typing.Iterable[ScheduleInstance]
+    ) -> typing.Dict[ShiftKey, typing.List[ClimbShift]]:
+        """Get the shifts with open spots for all given schedule instances.
+        Every (date, area) combination is fetched once, and all of them concurrently.
+        The combinations that could not be fetched are left out.
+        """
+        keys: typing.List[ShiftKey] = list(
+            dict.fromkeys((inst.time.date(), inst.area or "") for inst in instances)
+        )
+        results = await asyncio.gather(
+            *(self.get_available_shifts(*key) for key in keys)
+        )
+        return {key: shifts for key, shifts in zip(keys, results) if shifts is not None}
+
+    @property
+    def auth_header(self) -> dict:
+        """ The authentication header if a login has been done, otherwise an empty dict."""
+        if self._email and self._token:
+            return {"X-USER-EMAIL": self._email, "X-USER-TOKEN": self._token}
+        return {}
+
+    @property
+    def area_cache_hits(self) -> int:
+        return self._areas.hits
+
+    @property
+    def area_cache_misses(self) -> int:
+        return self._areas.misses
+
+    @property
+    def gym_id_set(self) -> bool:
+        return self._gym_id is not None
+
+    @property
+    def logged_in(self) -> bool:
+        return self._token is not None
@@ -0,0 +1,259 @@
+"""
+HTTP transport of the api: rate limits, timeouts, retries and a circuit breaker.
+"""
+import logging
+import random
+import threading
+import time
+import typing
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+# Requests per second to a host, and the burst allowed on top of that.
+RATE = 5.0
+BURST = 20
+# (connect, read) timeouts in seconds.
+TIMEOUT = (3.05, 10.0)
+RETRIES = 3
+BACKOFF = 0.5
+MAX_BACKOFF = 8.0
+# Consecutive failures before the circuit opens, and seconds before a new try.
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+# Methods that can be repeated without side effects.
+_IDEMPOTENT = frozenset(["GET", "HEAD", "OPTIONS"])
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """ Raised without a request while the api of the host is considered down."""
+
+
+class TokenBucket:
+    """ Allows rate requests per second on average, with bursts up to the capacity."""
+
+    def __init__(self, rate: float = RATE, capacity: float = BURST):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Take a token, waits until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._capacity, self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Stops requests to a host after repeated failures.
+    After the reset timeout a single trial request is let through (half open),
+    which closes the circuit again on success.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    # Gauge values of the states.
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        host: str,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+    ):
+        self._host = host
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = 0.0
+        self._trial = False
+        self._state = self.CLOSED
+        self._lock = threading.Lock()
+        self._publish()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        """ Whether a request may be done now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened < self._reset_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            if self._trial:
+                # Only one trial request at a time.
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial = False
+            if self._state != self.CLOSED:
+                _LOGGER.info(f"Api of {self._host} is back, closing the circuit")
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED
+                and self._failures >= self._failure_threshold
+            ):
+                _LOGGER.warning(f"Api of {self._host} is failing, opening the circuit")
+                self._opened = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        self._state = state
+        self._publish()
+
+    def _publish(self):
+        metrics.REGISTRY.set(
+            "toplogger_circuit_state",
+            self._STATE_VALUES[self._state],
+            "State of the circuit breaker (0 closed, 1 half open, 2 open)",
+            host=self._host,
+        )
+
+
+class ResilientAdapter(HTTPAdapter):
+    """Transport adapter with a token bucket and circuit breaker per host,
+    default timeouts and retries with exponential backoff.
+    Server errors and read errors are only retried for idempotent methods, a post
+    is only repeated if the connection could not be made at all.
+    """
+
+    def __init__(
+        self,
+        rate: float = RATE,
+        burst: int = BURST,
+        timeout: typing.Tuple[float, float] = TIMEOUT,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        max_backoff: float = MAX_BACKOFF,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self._rate = rate
+        self._burst = burst
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+
+        self._hosts_lock = threading.Lock()
+        self._buckets: typing.Dict[str, TokenBucket] = {}
+        self._breakers: typing.Dict[str, CircuitBreaker] = {}
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        """ The circuit breaker of a host."""
+        with self._hosts_lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    host, self._failure_threshold, self._reset_timeout
+                )
+            return self._breakers[host]
+
+    def _bucket(self, host: str) -> TokenBucket:
+        with self._hosts_lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self._rate, self._burst)
+            return self._buckets[host]
+
+    def send(
+        self, request: requests.PreparedRequest, timeout=None, **kwargs
+    ) -> requests.Response:  # pylint: disable=arguments-differ
+        host = urllib.parse.urlsplit(request.url).netloc
+        breaker = self.breaker(host)
+        bucket = self._bucket(host)
+        if timeout is None:
+            timeout = self._timeout
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(
+                    f"Circuit of {host} is open, not sending the request",
+                    request=request,
+                )
+            bucket.acquire()
+            try:
+                response = super().send(request, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                breaker.record_failure()
+                if not self._can_retry(request, err, attempt, breaker):
+                    raise
+            else:
+                if response.status_code < 500:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if not self._can_retry(request, None, attempt, breaker):
+                    return response
+                response.close()
+
+            attempt += 1
+            metrics.REGISTRY.inc(
+                "toplogger_http_retries_total",
+                help_text="Retried Toplogger api requests",
+                host=host,
+            )
+            time.sleep(self._backoff_time(attempt))
+
+    def _backoff_time(self, attempt: int) -> float:
+        """ Exponential backoff with full jitter."""
+        return random.uniform(
+            0, min(self._max_backoff, self._backoff * 2 ** (attempt - 1))
+        )
+
+    def _can_retry(
+        self,
+        request: requests.PreparedRequest,
+        err: typing.Optional[Exception],
+        attempt: int,
+        breaker: CircuitBreaker,
+    ) -> bool:
+        if attempt >= self._retries or breaker.state == CircuitBreaker.OPEN:
+            return False
+        if request.method in _IDEMPOTENT:
+            return True
+        # The request never reached the server.
+        return isinstance(err, requests.exceptions.ConnectTimeout)
+
+
+def resilient_session(**kwargs) -> requests.Session:
+    """ A session with the resilient adapter, the arguments are for the adapter."""
+    session = requests.Session()
+    adapter = ResilientAdapter(**kwargs)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,42 @@
+"""
+Micro benchmark of the timestamp parsing of the api responses.
+Run from the repository root with: python -m benchmarks.bench_datetime
+"""
+import datetime
+import timeit
+
+from app.toplogger import get_datetime
+
+REPEAT = 100_000
+
+# A day of slots, which are parsed again on every poll.
+TIMESTAMPS = [f"2021-03-22T{hour:02d}:00:00.000+01:00" for hour in range(8, 23)]
+
+
+def get_datetime_strptime(string_input: str) -> datetime.datetime:
+    """ The strptime implementation, which strips off the timezone."""
+    date_str = string_input.split(".", 2)[0]
+    return datetime.datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
+
+
+def get_datetime_uncached(string_input: str) -> datetime.datetime:
+    """ The fromisoformat implementation, without the memo cache."""
+    return get_datetime.__wrapped__(string_input)
+
+
+def run(name: str, parse):
+    amount = REPEAT * len(TIMESTAMPS)
+    duration = timeit.timeit(
+        lambda: [parse(stamp) for stamp in TIMESTAMPS], number=REPEAT
+    )
+    print(f"{name:<25} {duration / amount * 1e9:8.1f} ns per timestamp")
+
+
+def main():
+    run("strptime", get_datetime_strptime)
+    run("fromisoformat", get_datetime_uncached)
+    run("fromisoformat + cache", get_datetime)
+
+
+if __name__ == "__main__":
+    main()
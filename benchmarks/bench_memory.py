@@ -0,0 +1,102 @@
+"""
+Memory benchmark of the schedule instances and climb shifts.
+Run from the repository root with: python -m benchmarks.bench_memory
+"""
+import datetime
+import gc
+import tracemalloc
+import typing
+
+from app.schedule import ScheduleInstance, ShiftState
+from app.toplogger import ClimbShift, get_datetime
+
+AMOUNT = 100_000
+
+
+class DictScheduleInstance:
+    """ The schedule instance as it was, with a per instance __dict__."""
+
+    def __init__(self, datetime_spec: datetime.datetime, area: str = None):
+        self._datetime = datetime_spec
+        self._area = area
+        self._state = ShiftState.UNKNOWN
+        self._statechange = False
+        self._on_state_change = None
+
+
+class DictClimbShift:
+    """ The climb shift as it was, with a per instance __dict__."""
+
+    def __init__(self, json_req: dict, area=""):
+        self._area = area
+        self._start = get_datetime(json_req["start_at"])
+        self._end = get_datetime(json_req["end_at"])
+
+
+def measure(create: typing.Callable[[], typing.Any]) -> typing.Tuple[int, int]:
+    """ The memory (in bytes) held by the result, and the amount of live blocks."""
+    gc.collect()
+    tracemalloc.start()
+    result = create()
+    snapshot = tracemalloc.take_snapshot()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+    del result
+    return size, blocks
+
+
+def slot_json(amount: int) -> typing.List[dict]:
+    """ Slots of two hours, for 7 slots a day."""
+    start = datetime.datetime(2021, 1, 1, 8)
+    slots = []
+    for i in range(amount):
+        slot_start = start + datetime.timedelta(days=i // 7, hours=2 * (i % 7))
+        slot_end = slot_start + datetime.timedelta(hours=2)
+        slots.append(
+            {
+                "start_at": f"{slot_start:%Y-%m-%dT%H:%M:%S}.000+01:00",
+                "end_at": f"{slot_end:%Y-%m-%dT%H:%M:%S}.000+01:00",
+            }
+        )
+    return slots
+
+
+def report(name: str, result: typing.Tuple[int, int]):
+    size, blocks = result
+    print(f"{name:<40} {size / 2 ** 20:8.2f} MiB {blocks:10d} blocks")
+
+
+def main():
+    start = datetime.datetime(2021, 1, 1, 8)
+    times = [start + datetime.timedelta(minutes=30 * i) for i in range(AMOUNT)]
+    report(
+        f"{AMOUNT} dict schedule instances",
+        measure(lambda: [DictScheduleInstance(t, "Boulder") for t in times]),
+    )
+    report(
+        f"{AMOUNT} slotted schedule instances",
+        measure(lambda: [ScheduleInstance(t, "Boulder") for t in times]),
+    )
+
+    slots = slot_json(AMOUNT)
+    report(
+        f"{AMOUNT} dict climb shifts",
+        measure(lambda: [DictClimbShift(slot, "Boulder") for slot in slots]),
+    )
+    report(
+        f"{AMOUNT} slotted climb shifts",
+        measure(lambda: [ClimbShift(slot, "Boulder") for slot in slots]),
+    )
+
+    # A second poll with the same slots reuses the shifts of the first one.
+    first_poll = [ClimbShift.from_json(slot, "Boulder") for slot in slots]
+    report(
+        f"{AMOUNT} climb shifts, second poll",
+        measure(lambda: [ClimbShift.from_json(slot, "Boulder") for slot in slots]),
+    )
+    del first_poll
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark of a complete poll against the fake Toplogger api.
+Run from the repository root with: python -m benchmarks.bench_poll
+"""
+import argparse
+import calendar
+import contextlib
+import io
+import time
+import tracemalloc
+import typing
+
+import test_app
+from app.schedule import ScheduleHandler
+from app.toplogger import ToploggerApi
+from app.transport import resilient_session
+
+from .fake_toplogger import FakeToplogger
+
+# (timespecs per day, days to plan ahead)
+SCHEDULE_SIZES = [(1, 7), (4, 14), (8, 28), (8, 90)]
+
+
+def schedule_config(per_day: int, days: int) -> dict:
+    """ A schedule with per_day timespecs on every day, spread over the areas."""
+    timespec = {
+        day.lower(): [
+            {
+                "hour": 8 + (13 * i) // per_day,
+                "minute": 30,
+                "area": "Boulder" if i % 2 else "Lead",
+            }
+            for i in range(per_day)
+        ]
+        for day in calendar.day_name
+    }
+    return {"gym": "Gym 1", "days": days, "timespec": timespec}
+
+
+def run(fake: FakeToplogger, per_day: int, days: int, polls: int) -> typing.Dict:
+    # Without the rate limit, the benchmark measures the poll and not the limit.
+    api = ToploggerApi(url=fake.url, session=resilient_session(rate=1e6, burst=1000))
+    api.login("bench@example.com", "secret")
+    api.pick_gym("Gym 1")
+    sched = ScheduleHandler(schedule_config(per_day, days))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # The first poll fills all the caches.
+        test_app.update(api, sched)
+        instances = len(list(sched.get_dates()))
+
+        requests_before = fake.request_count
+        tic = time.perf_counter()
+        for _ in range(polls):
+            test_app.update(api, sched)
+        duration = time.perf_counter() - tic
+        requests = (fake.request_count - requests_before) / polls
+
+        tracemalloc.start()
+        test_app.update(api, sched)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "instances": instances,
+        "polls_per_second": polls / duration,
+        "requests_per_poll": requests,
+        "peak_kib": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--polls", type=int, default=10)
+    parser.add_argument("--slots-per-day", type=int, default=28)
+    parser.add_argument("--latency", type=float, default=0.0, help="in seconds")
+    args = parser.parse_args()
+
+    print(
+        f"{'instances':>10} {'polls/s':>10} {'requests/poll':>14} {'peak memory':>12}"
+    )
+    with FakeToplogger(slots_per_day=args.slots_per_day, latency=args.latency) as fake:
+        for per_day, days in SCHEDULE_SIZES:
+            result = run(fake, per_day, days, args.polls)
+            print(
+                f"{result['instances']:>10} {result['polls_per_second']:>10.2f} "
+                f"{result['requests_per_poll']:>14.1f} {result['peak_kib']:>9.0f} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark of the sharded poller against the fake Toplogger api, per process count.
+Run from the repository root with: python -m benchmarks.bench_shards
+"""
+import argparse
+import logging
+import os
+import time
+
+from app.shards import ShardedPoller
+
+from .bench_poll import schedule_config
+from .fake_toplogger import FakeToplogger
+
+
+def account_configs(gyms: int, per_day: int, days: int):
+    """ One account per gym, every account with the same schedule."""
+    for gym in range(1, gyms + 1):
+        config = schedule_config(per_day, days)
+        config.update(
+            {"gym": f"Gym {gym}", "username": f"user{gym}@example.com", "password": "x"}
+        )
+        yield config
+
+
+def run(fake: FakeToplogger, processes: int, args: argparse.Namespace) -> float:
+    """ The polls per second with the number of processes."""
+    poller = ShardedPoller(
+        account_configs(args.gyms, args.per_day, args.days),
+        processes,
+        url=fake.url,
+        rate=1e6,
+        burst=1000,
+    )
+    with poller:
+        # The first poll fills the caches of the workers.
+        poller.poll()
+        tic = time.perf_counter()
+        for _ in range(args.polls):
+            poller.poll()
+        duration = time.perf_counter() - tic
+
+    if any(shard.errors for shard in poller.health()):
+        print(f"Failing shards: {poller.health()}")
+    return args.polls / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--gyms", type=int, default=32)
+    parser.add_argument("--per-day", type=int, default=4)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--polls", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="in seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    print(f"{'processes':>10} {'polls/s':>10} {'speedup':>8}")
+    with FakeToplogger(gyms=args.gyms, latency=args.latency) as fake:
+        base = None
+        for processes in counts:
+            rate = run(fake, processes, args)
+            base = base or rate
+            print(f"{processes:>10} {rate:>10.2f} {rate / base:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+An in process stub of the Toplogger api, serving synthetic gyms.
+"""
+import datetime
+import hashlib
+import json
+import threading
+import time
+import typing
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKEN = "fake-token"
+
+
+class FakeToplogger:
+    """A local http server behaving like the Toplogger api.
+    Every gym has the given areas, and each area has slots_per_day slots on every day.
+    Every third slot is fully booked.
+    """
+
+    def __init__(
+        self,
+        gyms: int = 100,
+        areas: typing.Sequence[str] = ("Boulder", "Lead"),
+        slots_per_day: int = 7,
+        latency: float = 0.0,
+    ):
+        self.gyms = [{"id": i, "name": f"Gym {i}"} for i in range(1, gyms + 1)]
+        self.areas = [{"id": i, "name": name} for i, name in enumerate(areas, 1)]
+        self.slots_per_day = slots_per_day
+        self.latency = latency
+        self.reservations: typing.List[dict] = []
+        # The reservations need the current token, see expire_token.
+        self.token = TOKEN
+        self._logins = 0
+
+        self.requests: typing.Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread: typing.Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self) -> int:
+        return sum(self.requests.values())
+
+    def start(self) -> "FakeToplogger":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeToplogger":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def slots(self, date: str, area_id: typing.Optional[int]) -> typing.List[dict]:
+        """ The slots of a day, between 8:00 and 22:00."""
+        day = datetime.datetime.strptime(date, "%Y-%m-%d")
+        length = datetime.timedelta(minutes=14 * 60 // self.slots_per_day)
+        areas = [area for area in self.areas if area_id in (None, area["id"])]
+
+        slots = []
+        for area in areas:
+            for i in range(self.slots_per_day):
+                start = day + datetime.timedelta(hours=8) + i * length
+                slots.append(
+                    {
+                        "id": int(f"{area['id']}{day:%y%m%d}{i:03d}"),
+                        "start_at": f"{start:%Y-%m-%dT%H:%M:%S}.000",
+                        "end_at": f"{start + length:%Y-%m-%dT%H:%M:%S}.000",
+                        "spots": 10,
+                        "spots_booked": 10 if i % 3 == 0 else 9,
+                        "reservation_area_id": area["id"],
+                    }
+                )
+        return slots
+
+    def expire_token(self):
+        """ Reject the current token, the next login gets a new one."""
+        with self._lock:
+            self._logins += 1
+            self.token = f"{TOKEN}-{self._logins}"
+
+    def _route(
+        self,
+        method: str,
+        path: str,
+        query: typing.Dict[str, str],
+        body: dict,
+        token: typing.Optional[str] = None,
+    ) -> typing.Tuple[int, typing.Any]:
+        parts = path.strip("/").split("/")
+        if method == "POST" and path == "/users/sign_in.json":
+            return 200, {"authentication_token": self.token}
+        if parts == ["v1", "gyms"]:
+            return 200, self.gyms
+        if len(parts) != 4 or parts[:2] != ["v1", "gyms"]:
+            return 404, {}
+
+        endpoint = parts[3]
+        if endpoint == "reservation_areas":
+            return 200, self.areas
+        if endpoint == "slots":
+            area_id = query.get("reservation_area_id")
+            return 200, self.slots(query["date"], int(area_id) if area_id else None)
+        if endpoint == "reservations" and token != self.token:
+            return 401, {"error": "Invalid token"}
+        if endpoint == "reservations" and method == "GET":
+            return 200, self.reservations
+        if endpoint == "reservations" and method == "POST":
+            reservation = self.reservation(body.get("reservation", {}).get("slot_id"))
+            if reservation is None:
+                return 422, {"error": "Slot not found or full"}
+            with self._lock:
+                self.reservations.append(reservation)
+            return 201, reservation
+        return 404, {}
+
+    def reservation(self, slot_id: typing.Any) -> typing.Optional[dict]:
+        """ The reservation record of a slot with open spots, None if there is none."""
+        # The slot id is the area id, followed by the date and the index of the slot.
+        text = str(slot_id)
+        if len(text) < 10 or not text.isdigit():
+            return None
+        date = datetime.datetime.strptime(text[-9:-3], "%y%m%d")
+        area_id = int(text[:-9])
+        areas = {area["id"]: area for area in self.areas}
+        for slot in self.slots(f"{date:%Y-%m-%d}", area_id):
+            if slot["id"] == slot_id and slot["spots_booked"] < slot["spots"]:
+                return {
+                    "id": len(self.reservations) + 1,
+                    "slot_id": slot["id"],
+                    "slot_start_at": slot["start_at"],
+                    "slot_end_at": slot["end_at"],
+                    "reservation_area_id": area_id,
+                    "reservation_area": areas[area_id],
+                }
+        return None
+
+    def _handler(self) -> typing.Type[BaseHTTPRequestHandler]:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                self._respond("GET")
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                self._respond("POST")
+
+            def _respond(self, method: str):
+                parsed = urllib.parse.urlparse(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length)) if length else {}
+
+                with fake._lock:
+                    fake.requests[parsed.path] += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                query = dict(urllib.parse.parse_qsl(parsed.query))
+                status, data = fake._route(
+                    method, parsed.path, query, body, self.headers.get("X-USER-TOKEN")
+                )
+                content = json.dumps(data).encode()
+                etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+
+                if method == "GET" and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
@@ -1 +1,137 @@
+"""
+Home assistant side of the sniper: one coordinator polls the schedule in the
+background, and publishes the schedule instances as entities.
+"""
+import logging
+import re
+import typing
+import unicodedata
 
+from ..app.booking import BookingEngine
+from ..app.change_feed import ChangeFeed, SlotDelta, delta_to_json
+from ..app.poll import poll_instances
+from ..app.poll_scheduler import PollScheduler
+from ..app.schedule import ScheduleHandler, ScheduleInstance
+from ..app.toplogger import ToploggerApi
+
+_LOGGER = logging.getLogger(__name__)
+
+ENTITY_DOMAIN = "toplogger_sniper"
+EVENT_SHIFT_STATE = f"{ENTITY_DOMAIN}_shift_state"
+EVENT_SLOTS_CHANGED = f"{ENTITY_DOMAIN}_slots_changed"
+EVENT_SHIFT_BOOKED = f"{ENTITY_DOMAIN}_shift_booked"
+
+
+def slugify(text: str) -> str:
+    """Lowercase ascii letters and digits, joined by single underscores.
+    The same rules as the slugify of home assistant, for valid object ids.
+    """
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+    return slug or "unknown"
+
+
+def entity_id(inst: ScheduleInstance) -> str:
+    """ The entity id of a schedule instance, stable over restarts."""
+    area = slugify(inst.area or "any")
+    return f"{ENTITY_DOMAIN}.{inst.time:%Y%m%d_%H%M}_{area}"
+
+
+def slot_delta_subscriber(hass) -> typing.Callable[[SlotDelta], None]:
+    """ A change feed subscriber, firing an event for every slot delta."""
+
+    def fire(delta: SlotDelta):
+        hass.bus.fire(EVENT_SLOTS_CHANGED, delta_to_json(delta))
+
+    return fire
+
+
+class SniperCoordinator:
+    """Polls the schedule in a background thread, away from the home assistant loop.
+    The instances are not wrapped in entity objects, only the states of changed
+    instances are written, so a large schedule stays cheap. An event is fired for
+    every state change.
+    """
+
+    def __init__(
+        self,
+        hass,
+        api: ToploggerApi,
+        sched: ScheduleHandler,
+        booking: typing.Optional[BookingEngine] = None,
+        feed: typing.Optional[ChangeFeed] = None,
+        **scheduler_kwargs,
+    ):
+        self._hass = hass
+        self._api = api
+        self._sched = sched
+        self._booking = booking
+        self._feed = feed
+        self._scheduler = PollScheduler(self.poll, sched, **scheduler_kwargs)
+        # Entity id per published instance, to remove the entities of passed shifts.
+        self._entities: typing.Dict[ScheduleInstance, str] = {}
+
+    def start(self):
+        if self._feed is not None:
+            self._feed.start()
+        self._scheduler.start()
+
+    def stop(self, *_):
+        """ Stop polling, also usable as the home assistant stop listener."""
+        self._scheduler.stop()
+        if self._feed is not None:
+            self._feed.stop()
+
+    @property
+    def running(self) -> bool:
+        return self._scheduler.running
+
+    def poll(self, instances: typing.List[ScheduleInstance]):
+        """ Poll the instances, and publish the changes."""
+        result = poll_instances(self._api, instances, self._booking)
+        if self._feed is not None:
+            self._feed.update(self._sched.gym, result.available)
+        self.publish()
+        for inst in result.booked:
+            self._hass.bus.fire(
+                EVENT_SHIFT_BOOKED,
+                {
+                    "entity_id": self._entities.get(inst, entity_id(inst)),
+                    "start": inst.time.isoformat(),
+                    "area": inst.area,
+                },
+            )
+
+    def publish(self):
+        """ Write the states of new and changed instances, and fire their events."""
+        current = list(self._sched.get_dates(include_taken=True))
+        for inst in current:
+            if inst in self._entities and not inst.has_update:
+                continue
+            if inst not in self._entities:
+                self._entities[inst] = entity_id(inst)
+            self._hass.states.set(
+                self._entities[inst],
+                inst.state.name.lower(),
+                {
+                    "start": inst.time.isoformat(),
+                    "area": inst.area,
+                    "gym": self._sched.gym,
+                },
+            )
+            if inst.has_update:
+                self._hass.bus.fire(
+                    EVENT_SHIFT_STATE,
+                    {
+                        "entity_id": self._entities[inst],
+                        "start": inst.time.isoformat(),
+                        "area": inst.area,
+                        "state": inst.state.name.lower(),
+                    },
+                )
+                inst.processed()
+
+        if len(current) != len(self._entities):
+            keep = set(current)
+            for inst in [inst for inst in self._entities if inst not in keep]:
+                self._hass.states.remove(self._entities.pop(inst))
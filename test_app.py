@@ -1,44 +1,147 @@
+import logging
 import os
 import threading
+import typing
 
 import ruamel.yaml
+from app import metrics
+from app.booking import BookingEngine
+from app.change_feed import ChangeFeed, WebhookSubscriber, print_subscriber
 from app.toplogger import ToploggerApi
-from app.schedule import ScheduleHandler, ShiftState
+from app.poll import poll_instances
+from app.poll_scheduler import PollScheduler
+from app.pool import SniperPool
+from app.shards import ShardedPoller
+from app.schedule import ScheduleHandler, ScheduleInstance
+from app.state_store import STATE_FILE, StateStore
 
 
-def update(sniper_obj: ToploggerApi, sched: ScheduleHandler):
-    """ The update method."""
-    sched.update()
-
-    taken_shifts = sniper_obj.get_reservations()
-    for inst in sched.get_dates():
-        # First let's see if the shift is already taken.
-        for s in taken_shifts:
-            if s.area == inst.area and s.is_in(inst.time):
-                inst.state = ShiftState.TAKEN
-                break
-        else:
-            # Let's see if the shift is available or taken.
-            for s in sniper_obj.get_available_shifts(inst.time, inst.area):
-                if s.is_in(inst.time):
-                    inst.state = ShiftState.AVAILABLE
-                    break
-            else:
-                inst.state = ShiftState.FULL
-
-    # And let's print all the updates
-    for inst in sched.get_dates():
+def print_updates(sched: ScheduleHandler):
+    """ Print all the instances of which the state changed."""
+    for inst in sched.get_dates(include_taken=True):
         if inst.has_update:
             print(inst)
             inst.processed()
 
 
+def update(
+    sniper_obj: ToploggerApi,
+    sched: ScheduleHandler,
+    instances: typing.Optional[typing.List[ScheduleInstance]] = None,
+    booking: typing.Optional[BookingEngine] = None,
+    feed: typing.Optional[ChangeFeed] = None,
+    early_stop: bool = False,
+):
+    """The update method, by default for all instances that are not yet taken.
+    With a booking engine, available shifts are booked right away.
+    With a change feed, the changed slots are sent to its subscribers.
+    With early_stop the slots are only read up to the instances, the change feed
+    needs whole days so it is ignored then.
+    """
+    with metrics.REGISTRY.timed(
+        "poll_cycle_seconds", "Duration of a complete poll.", mode="single"
+    ):
+        _update(sniper_obj, sched, instances, booking, feed, early_stop)
+
+
+def _update(
+    sniper_obj: ToploggerApi,
+    sched: ScheduleHandler,
+    instances: typing.Optional[typing.List[ScheduleInstance]],
+    booking: typing.Optional[BookingEngine],
+    feed: typing.Optional[ChangeFeed],
+    early_stop: bool,
+):
+    sched.update()
+
+    if instances is None:
+        instances = list(sched.get_dates())
+    result = poll_instances(
+        sniper_obj, instances, booking, early_stop and feed is None
+    )
+    if feed is not None:
+        feed.update(sched.gym, result.available)
+
+    # And let's print the bookings and all the updates
+    for inst in result.booked:
+        print(f"Booked: {inst}")
+        inst.processed()
+    print_updates(sched)
+
+
+def run_pool(configs: typing.List[dict]):
+    """ Snipe for all configured accounts, until enter is pressed."""
+    pool = SniperPool(configs)
+    if not pool.login():
+        active = [acc for acc in pool.accounts if acc.api.gym_id is not None]
+        if not active:
+            pool.close()
+            raise ValueError("None of the accounts in accounts.yaml could login")
+        print(f"Polling for {len(active)} of the {len(pool.accounts)} accounts")
+
+    def poll(instances: typing.List[ScheduleInstance]):
+        pool.poll(instances)
+        for account, inst in pool.updates():
+            print(f"{account.username}: {inst}")
+
+    # Only the accounts that logged in and picked their gym are polled.
+    scheduler = PollScheduler(
+        poll,
+        [acc.sched for acc in pool.accounts if acc.api.gym_id is not None],
+    )
+
+    scheduler.start()
+    input("Press [enter] to stop polling\n")
+    scheduler.stop()
+    pool.close()
+
+
+def run_sharded(configs: typing.List[dict], processes: int, interval: float = 30.0):
+    """ Snipe for all configured accounts from worker processes, until enter is pressed."""
+    poller = ShardedPoller(configs, processes)
+    if not poller.start():
+        print("Not all shards could login, see the log for the failing ones")
+
+    stop = threading.Event()
+
+    def poll_loop():
+        while not stop.is_set():
+            try:
+                poller.poll()
+                for (username, when, area), state in poller.updates():
+                    area = f" {area}" if area else ""
+                    print(f"{username}: {when:%A %d-%B %H:%M}{area} {state.name}")
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Sharded poll failed")
+            stop.wait(interval)
+
+    poll_thread = threading.Thread(target=poll_loop, name="ShardedPoll", daemon=True)
+    poll_thread.start()
+    input("Press [enter] to stop polling\n")
+    stop.set()
+    poll_thread.join()
+    poller.close()
+
+
 def main():
     """ The actual running method."""
     pwd = None
     usr = None
     yaml = ruamel.yaml.YAML()
 
+    # With an accounts file we snipe for all accounts in there. Either a list of
+    # accounts, or a mapping with the accounts and the number of worker processes.
+    if os.path.exists("accounts.yaml"):
+        with open("accounts.yaml") as config_file:
+            data = yaml.load(config_file)
+        if isinstance(data, dict) and data.get("processes"):
+            run_sharded(list(data["accounts"]), int(data["processes"]))
+        elif isinstance(data, dict):
+            run_pool(list(data["accounts"]))
+        else:
+            run_pool(list(data))
+        return
+
     # Read in the username / password
     if not os.path.exists("secrets.yaml"):
         raise ValueError("Expected a 'secrets.yaml' file")
@@ -58,19 +161,45 @@ def main():
     with open("schedule.yaml") as config_file:
         data = yaml.load(config_file)
 
-    sched = ScheduleHandler(data)
+    # Continue from the state of the last run, where it is still valid.
+    store = StateStore(data.get("state_file", STATE_FILE))
+    sched = ScheduleHandler(data, store.load_states(data["gym"]))
     sniper_obj = ToploggerApi()
-    sniper_obj.login(usr, pwd)
-    sniper_obj.pick_gym(data["gym"])
+    logged_in, gym_picked = store.restore_api(sniper_obj, usr, data["gym"], pwd)
+    if not logged_in:
+        sniper_obj.login(usr, pwd)
+    if not gym_picked:
+        sniper_obj.pick_gym(data["gym"])
+    store.save_api(sniper_obj, data["gym"])
+    store.watch_api(sniper_obj)
+    booking = BookingEngine(sniper_obj) if data.get("auto_book", False) else None
+    metrics_file = data.get("metrics_file")
+    early_stop = data.get("early_stop", False)
+
+    # Push the opened and closed slots, to stdout and optionally a webhook.
+    feed = None
+    if data.get("change_feed", False) or data.get("webhook_url"):
+        feed = ChangeFeed()
+        feed.subscribe(print_subscriber)
+        if data.get("webhook_url"):
+            feed.subscribe(WebhookSubscriber(data["webhook_url"]))
+        feed.start()
+
+    def poll(instances: typing.List[ScheduleInstance]):
+        update(sniper_obj, sched, instances, booking, feed, early_stop)
+        store.save_states(sched.gym, sched.get_dates(include_taken=True))
+        if metrics_file:
+            metrics.REGISTRY.write(metrics_file)
 
-    update_thread = threading.Timer(30.0, update, args=(sniper_obj, sched))
+    scheduler = PollScheduler(poll, sched)
 
-    # update_thread.start()
-    update(sniper_obj, sched)
-    if update_thread.is_alive():
-        input("Press [enter] to stop thread\n")
-        update_thread.cancel()
-        update_thread.join()
+    scheduler.start()
+    input("Press [enter] to stop polling\n")
+    scheduler.stop()
+    if feed is not None:
+        feed.stop()
+    sniper_obj.on_token_change(None)
+    store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,31 @@
+"""
+Checks of the token management against the fake Toplogger api.
+"""
+import concurrent.futures
+
+from app.toplogger import ToploggerApi, _ApiPath
+from app.transport import resilient_session
+from benchmarks.fake_toplogger import FakeToplogger
+
+LOGIN_PATH = "/users/sign_in.json"
+
+
+def test_concurrent_401_login_once():
+    with FakeToplogger(gyms=1) as fake:
+        api = ToploggerApi(
+            url=fake.url, session=resilient_session(rate=1e6, burst=1000)
+        )
+        assert api.login("test@example.com", "secret")
+        assert api.pick_gym("Gym 1")
+        fake.expire_token()
+
+        url = _ApiPath.RESERVATIONS.url(fake.url, api.gym_id)
+        auth = api._auth  # pylint: disable=protected-access
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            responses = list(
+                executor.map(lambda _: auth.get(url, headers=api.auth_header), range(8))
+            )
+
+    assert [r.status_code for r in responses] == [200] * 8
+    assert fake.requests[LOGIN_PATH] == 2
+    assert api.token == fake.token
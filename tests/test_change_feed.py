@@ -0,0 +1,47 @@
+"""
+Checks of the change feed of the available slots.
+"""
+import datetime
+
+from app.change_feed import ChangeFeed
+from app.toplogger import ClimbShift
+
+DATE = datetime.date(2030, 1, 2)
+
+
+def shift(slot_id: int, hour: int) -> ClimbShift:
+    return ClimbShift(
+        {
+            "id": slot_id,
+            "start_at": f"{DATE}T{hour:02d}:00:00",
+            "end_at": f"{DATE}T{hour + 2:02d}:00:00",
+        }
+    )
+
+
+def test_failed_fetch_is_not_a_closed_slot():
+    feed = ChangeFeed()
+    assert len(feed.diff("Gym 1", {(DATE, ""): [shift(1, 10)]})) == 1
+
+    # The (date, area) is missing when fetching it failed.
+    assert feed.diff("Gym 1", {}) == []
+
+    (delta,) = feed.diff("Gym 1", {(DATE, ""): []})
+    assert [item.slot_id for item in delta.removed] == [1]
+
+
+def test_restart_after_stop():
+    deltas = []
+    feed = ChangeFeed()
+    feed.subscribe(deltas.append)
+
+    # Deltas from before the start are delivered once it runs.
+    feed.update("Gym 1", {(DATE, ""): [shift(1, 10)]})
+    feed.start()
+    feed.stop(5.0)
+
+    feed.update("Gym 1", {(DATE, ""): [shift(1, 10), shift(2, 12)]})
+    feed.start()
+    feed.stop(5.0)
+
+    assert [[item.slot_id for item in delta.added] for delta in deltas] == [[1], [2]]
@@ -0,0 +1,149 @@
+"""
+Checks of the home assistant coordinator, with a minimal fake of hass.
+"""
+import datetime
+import importlib.util
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def load_integration():
+    """ Import the repository as the home assistant package it is installed as."""
+    name = "toplogger_sniper"
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            name, ROOT / "__init__.py", submodule_search_locations=[str(ROOT)]
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+load_integration()
+# pylint: disable=wrong-import-position,import-error
+from toplogger_sniper.app.schedule import ScheduleInstance, ShiftState
+from toplogger_sniper.app.toplogger import ClimbShift
+from toplogger_sniper.integrations import home_assistant as ha
+
+
+class FakeStates:
+    def __init__(self):
+        self.states = {}
+
+    def set(self, entity, state, attributes=None):
+        self.states[entity] = (state, attributes)
+
+    def remove(self, entity):
+        return self.states.pop(entity, None) is not None
+
+
+class FakeBus:
+    def __init__(self):
+        self.events = []
+
+    def fire(self, event_type, data=None):
+        self.events.append((event_type, data))
+
+    def listen_once(self, event_type, listener):
+        pass
+
+
+class FakeHass:
+    def __init__(self):
+        self.states = FakeStates()
+        self.bus = FakeBus()
+        self.data = {}
+
+
+class FakeSchedule:
+    """ A schedule of which the test decides the instances."""
+
+    gym = "Gym 1"
+
+    def __init__(self, instances):
+        self.instances = list(instances)
+
+    def update(self):
+        pass
+
+    def get_dates(self, include_taken=False):
+        yield from (
+            inst
+            for inst in self.instances
+            if include_taken or inst.state != ShiftState.TAKEN
+        )
+
+
+class FakeApi:
+    """ Every instance is available at the start of the slot."""
+
+    def get_reservations(self):
+        return []
+
+    def get_available_shifts_bulk(self, instances, early_stop=False, on_fetched=None):
+        available = {}
+        for inst in instances:
+            start = inst.time.replace(minute=0)
+            shift = ClimbShift(
+                {
+                    "start_at": start.isoformat(),
+                    "end_at": (start + datetime.timedelta(hours=2)).isoformat(),
+                },
+                inst.area or "",
+            )
+            available.setdefault((inst.time.date(), inst.area or ""), []).append(shift)
+        for key, shifts in available.items():
+            on_fetched(key, shifts, 0.0)
+        return available
+
+
+@pytest.mark.parametrize(
+    "area, expected",
+    [
+        ("Boulder", "boulder"),
+        ("Lead & Top rope", "lead_top_rope"),
+        ("  Zaal 1 ", "zaal_1"),
+        ("Bouldérzaal", "boulderzaal"),
+        ("__", "unknown"),
+        (None, "any"),
+    ],
+)
+def test_entity_id(area, expected):
+    inst = ScheduleInstance(datetime.datetime(2030, 1, 2, 18, 30), area)
+    assert ha.entity_id(inst) == f"{ha.ENTITY_DOMAIN}.20300102_1830_{expected}"
+
+
+def test_publish_events_and_removal():
+    hass = FakeHass()
+    first = ScheduleInstance(datetime.datetime(2030, 1, 2, 18, 30), "Boulder")
+    second = ScheduleInstance(datetime.datetime(2030, 1, 3, 18, 30), "Lead")
+    sched = FakeSchedule([first, second])
+    coordinator = ha.SniperCoordinator(hass, FakeApi(), sched)
+
+    coordinator.poll([first, second])
+    assert hass.states.states == {
+        ha.entity_id(first): (
+            "available",
+            {"start": first.time.isoformat(), "area": "Boulder", "gym": "Gym 1"},
+        ),
+        ha.entity_id(second): (
+            "available",
+            {"start": second.time.isoformat(), "area": "Lead", "gym": "Gym 1"},
+        ),
+    }
+    assert [event for event, _ in hass.bus.events] == [ha.EVENT_SHIFT_STATE] * 2
+
+    # Unchanged instances are not written again.
+    hass.bus.events.clear()
+    coordinator.poll([first, second])
+    assert not hass.bus.events
+
+    # The entity of a passed instance is removed.
+    sched.instances = [second]
+    coordinator.publish()
+    assert list(hass.states.states) == [ha.entity_id(second)]
@@ -0,0 +1,44 @@
+"""
+Checks of the streaming parser of json arrays.
+"""
+import json
+import random
+
+import pytest
+
+from app.json_stream import iter_json_array
+
+DOCUMENTS = [
+    "[]",
+    " [ 1.5 , 2e3, -0.25E-2, 10 ] ",
+    '[true, false, null, "a, ]\\"b", "\\u00e9"]',
+    '[{"id": 1, "start_at": "2030-01-02T10:00:00", "spots": [1, [2, {}]]}, []]',
+    json.dumps([{"id": i, "spots": i * 1.25, "name": "Zaal é"} for i in range(20)]),
+]
+
+
+def chunks(data: bytes, cuts):
+    cuts = [0, *sorted(cuts), len(data)]
+    return [data[start:end] for start, end in zip(cuts, cuts[1:])]
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_every_split(document):
+    data = document.encode()
+    for cut in range(len(data) + 1):
+        assert list(iter_json_array(chunks(data, [cut]))) == json.loads(document)
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_random_splits(document):
+    rng = random.Random(document)
+    data = document.encode()
+    for _ in range(200):
+        cuts = rng.sample(range(len(data) + 1), rng.randint(1, min(10, len(data))))
+        assert list(iter_json_array(chunks(data, cuts))) == json.loads(document)
+
+
+@pytest.mark.parametrize("document", ["[1, 2", "[1.]", "[1 2]", '{"a": 1}'])
+def test_invalid(document):
+    with pytest.raises(ValueError):
+        list(iter_json_array([document.encode()]))
@@ -0,0 +1,121 @@
+"""
+Regression checks of a complete poll against the fake Toplogger api.
+The timings stay in the benchmarks, these check the request counts and bookings.
+"""
+import contextlib
+import io
+
+import pytest
+
+import test_app
+from app import metrics
+from app.booking import BookingEngine
+from app.poll import PollError, poll_instances
+from app.poll_scheduler import PollScheduler
+from app.schedule import ScheduleHandler, ShiftState
+from app.toplogger import ToploggerApi
+from app.transport import resilient_session
+from benchmarks.bench_poll import schedule_config
+from benchmarks.fake_toplogger import FakeToplogger
+
+RESERVATIONS_PATH = "/v1/gyms/1/reservations"
+SLOTS_PATH = "/v1/gyms/1/slots"
+
+
+@pytest.fixture
+def fake():
+    with FakeToplogger(gyms=2, slots_per_day=7) as server:
+        yield server
+
+
+def create_api(fake: FakeToplogger) -> ToploggerApi:
+    api = ToploggerApi(url=fake.url, session=resilient_session(rate=1e6, burst=1000))
+    assert api.login("test@example.com", "secret")
+    assert api.pick_gym("Gym 1")
+    return api
+
+
+def update(api: ToploggerApi, sched: ScheduleHandler, booking=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        test_app.update(api, sched, booking=booking)
+
+
+def test_requests_per_poll(fake):
+    api = create_api(fake)
+    sched = ScheduleHandler(schedule_config(3, 7))
+    update(api, sched)
+    groups = {(inst.time.date(), inst.area) for inst in sched.get_dates()}
+
+    fake.requests.clear()
+    update(api, sched)
+
+    # One request for the reservations, and one per date and area.
+    assert fake.requests[RESERVATIONS_PATH] == 1
+    assert fake.requests[SLOTS_PATH] <= len(groups)
+    assert fake.request_count == fake.requests[RESERVATIONS_PATH] + fake.requests[
+        SLOTS_PATH
+    ]
+
+
+def test_auto_booking_books_once(fake):
+    api = create_api(fake)
+    sched = ScheduleHandler(schedule_config(3, 2))
+    booking = BookingEngine(api)
+
+    update(api, sched, booking)
+    booked = len(fake.reservations)
+    assert booked > 0
+    assert booking.failures == 0
+    taken = {
+        inst
+        for inst in sched.get_dates(include_taken=True)
+        if inst.state == ShiftState.TAKEN
+    }
+    assert len(taken) == booked
+
+    # The next poll reads the reservations back, and books nothing again.
+    update(api, sched, booking)
+    assert len(fake.reservations) == booked
+    assert all(
+        inst.state == ShiftState.TAKEN
+        for inst in sched.get_dates(include_taken=True)
+        if inst in taken
+    )
+
+    # The latency from parsing the slots to the booking response is exported.
+    histogram = metrics.REGISTRY.get("booking_latency_seconds")
+    assert histogram.count >= booked
+    assert len(booking.latencies) == booked
+
+    # A new engine, eg. after a restart, does not book the held shifts either.
+    update(api, sched, BookingEngine(api))
+    assert len(fake.reservations) == booked
+
+
+class UnreachableApi:
+    """ An api of which every request fails."""
+
+    def get_reservations(self):
+        return None
+
+    def get_available_shifts_bulk(self, instances, early_stop=False, on_fetched=None):
+        return {}
+
+
+def test_failed_poll_backs_off():
+    sched = ScheduleHandler(schedule_config(3, 2))
+    scheduler = PollScheduler(
+        lambda instances: poll_instances(UnreachableApi(), instances),
+        sched,
+        default_interval=30.0,
+        jitter=0.0,
+        max_requests_per_minute=1000.0,
+    )
+    states = {inst: inst.state for inst in sched.get_dates(include_taken=True)}
+
+    # The next poll waits twice the default interval, instead of the interval.
+    assert scheduler.run_once() == pytest.approx(60.0, abs=1.0)
+    assert all(inst.state == state for inst, state in states.items())
+
+    with pytest.raises(PollError):
+        poll_instances(UnreachableApi(), list(sched.get_dates()))
@@ -0,0 +1,72 @@
+"""
+Checks of the sniper pool against the fake Toplogger api.
+"""
+import datetime
+
+import pytest
+
+from app.pool import SniperPool
+from app.schedule import ShiftState
+from benchmarks.bench_poll import schedule_config
+from benchmarks.fake_toplogger import FakeToplogger
+
+
+@pytest.fixture
+def fake():
+    with FakeToplogger(gyms=2, slots_per_day=7) as server:
+        yield server
+
+
+def reserve(fake: FakeToplogger, when: datetime.datetime, area: str):
+    """ Add the reservation of the slot at the time, as if booked elsewhere."""
+    area_id = next(item["id"] for item in fake.areas if item["name"] == area)
+    for slot in fake.slots(f"{when:%Y-%m-%d}", area_id):
+        if slot["start_at"] <= when.isoformat() < slot["end_at"]:
+            fake.reservations.append(fake.reservation(slot["id"]))
+            return
+    raise ValueError(f"No slot at {when}")
+
+
+def test_taken_updates(fake):
+    config = schedule_config(3, 2)
+    config.update({"username": "test@example.com", "password": "secret"})
+    pool = SniperPool([config], url=fake.url, rate=1e6, burst=1000)
+    try:
+        assert pool.login()
+        pool.poll()
+        list(pool.updates())
+
+        (account,) = pool.accounts
+        inst = next(
+            inst
+            for inst in account.sched.get_dates()
+            if inst.state == ShiftState.AVAILABLE
+            and inst.time > datetime.datetime.now() + datetime.timedelta(hours=1)
+        )
+        reserve(fake, inst.time, inst.area)
+        pool.poll()
+        assert [(acc, item.state) for acc, item in pool.updates()] == [
+            (account, ShiftState.TAKEN)
+        ]
+
+        # A cancelled booking is noticed, the taken instance is polled as well.
+        fake.reservations.clear()
+        pool.poll()
+        assert [item.state for _, item in pool.updates()] == [ShiftState.AVAILABLE]
+    finally:
+        pool.close()
+
+
+def test_login_fetches_public_data_once(fake):
+    configs = []
+    for i in range(20):
+        config = schedule_config(1, 1)
+        config.update({"username": f"user{i}@example.com", "password": "secret"})
+        configs.append(config)
+    pool = SniperPool(configs, url=fake.url, rate=1e6, burst=1000)
+    try:
+        assert pool.login()
+    finally:
+        pool.close()
+    assert fake.requests["/v1/gyms"] == 1
+    assert fake.requests["/v1/gyms/1/reservation_areas"] == 1
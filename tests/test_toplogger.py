@@ -0,0 +1,87 @@
+"""
+Checks of the slot fetches of the api, against the fake Toplogger api.
+"""
+import datetime
+
+import pytest
+
+from app import toplogger
+from app.change_feed import ChangeFeed
+from app.schedule import ScheduleInstance
+from app.toplogger import ToploggerApi
+from app.transport import resilient_session
+from benchmarks.fake_toplogger import FakeToplogger
+
+DATE = datetime.date.today() + datetime.timedelta(days=3)
+
+
+@pytest.fixture
+def fake():
+    with FakeToplogger(gyms=1, slots_per_day=7) as server:
+        yield server
+
+
+@pytest.fixture
+def api(fake):
+    api = ToploggerApi(url=fake.url, session=resilient_session(rate=1e6, burst=1000))
+    assert api.pick_gym("Gym 1")
+    return api
+
+
+def at(hour: int, minute: int = 30) -> datetime.datetime:
+    return datetime.datetime.combine(DATE, datetime.time(hour, minute))
+
+
+def test_bulk_fetches_whole_days(api):
+    feed = ChangeFeed()
+    late = ScheduleInstance(at(20), "Boulder")
+    early = ScheduleInstance(at(8), "Boulder")
+
+    feed.diff("Gym 1", api.get_available_shifts_bulk([late]))
+    # Another instance of the same day sees the same slots, nothing closed.
+    assert feed.diff("Gym 1", api.get_available_shifts_bulk([early])) == []
+
+
+def test_early_stop(fake, api):
+    # The slots start at 8:00 and last two hours, the first one is full.
+    shifts = list(api.iter_available_shifts(DATE, "Boulder", [at(10)]))
+    assert [shift.start for shift in shifts] == [at(10, 0)]
+
+    # A time in a full slot only is read till the end of the day.
+    shifts = list(api.iter_available_shifts(DATE, "Boulder", [at(8)]))
+    assert len(shifts) == len(fake.slots(f"{DATE}", 1)) - 3
+
+
+def test_early_stop_overlapping_slots(api, monkeypatch):
+    def slot(slot_id, start, end, booked):
+        return {
+            "id": slot_id,
+            "start_at": f"{at(start, 0).isoformat()}",
+            "end_at": f"{at(end, 0).isoformat()}",
+            "spots": 10,
+            "spots_booked": booked,
+        }
+
+    # A full slot from 10:00 to 12:00 overlaps an open one from 11:00 to 13:00.
+    slots = [slot(1, 10, 12, 10), slot(2, 11, 13, 5), slot(3, 13, 15, 5)]
+    monkeypatch.setattr(api, "_iter", lambda *args, **kwargs: iter(slots))
+
+    shifts = list(api.iter_available_shifts(DATE, "", [at(11)]))
+    assert [shift.slot_id for shift in shifts] == [2]
+
+
+def test_early_stop_bulk_small_chunks(fake, api, monkeypatch):
+    # Every slot is split over chunks, the streamed slots match the whole day.
+    monkeypatch.setattr(toplogger, "STREAM_CHUNK_SIZE", 7)
+    inst = ScheduleInstance(at(12), "Boulder")
+    whole = api.get_available_shifts_bulk([inst])
+    (key,) = whole
+
+    fetched = []
+    early = api.get_available_shifts_bulk(
+        [inst], early_stop=True, on_fetched=lambda *args: fetched.append(args[:2])
+    )
+    assert [shift.slot_id for shift in early[key]] == [
+        shift.slot_id for shift in whole[key] if shift.start <= at(12)
+    ]
+    assert fetched == [(key, early[key])]
@@ -0,0 +1,73 @@
+"""
+Checks of the async api against the fake Toplogger api.
+"""
+import asyncio
+import datetime
+
+from app.schedule import ScheduleInstance
+from app.toplogger import ToploggerApi
+from app.toplogger_async import AsyncToploggerApi
+from app.transport import resilient_session
+from benchmarks.fake_toplogger import FakeToplogger
+
+DATE = datetime.date.today() + datetime.timedelta(days=3)
+
+INSTANCES = [
+    ScheduleInstance(
+        datetime.datetime.combine(DATE + datetime.timedelta(days=day), time), area
+    )
+    for day in range(2)
+    for time, area in ((datetime.time(10, 30), "Boulder"), (datetime.time(18), "Lead"))
+]
+
+
+async def fetch(api: AsyncToploggerApi, fake: FakeToplogger):
+    async with api:
+        assert await api.login("test@example.com", "secret")
+        assert await api.pick_gym("Gym 1")
+        assert await api.get_reservations() == []
+        # Without the pooled connections, every new one is refused.
+        fake.stop()
+        await api.close()
+        return await api.get_available_shifts_bulk(INSTANCES)
+
+
+def test_bulk_matches_sync_api():
+    with FakeToplogger(gyms=1) as fake:
+        sync_api = ToploggerApi(
+            url=fake.url, session=resilient_session(rate=1e6, burst=1000)
+        )
+        assert sync_api.pick_gym("Gym 1")
+        expected = sync_api.get_available_shifts_bulk(INSTANCES)
+
+        async def run():
+            async with AsyncToploggerApi(url=fake.url) as api:
+                assert await api.pick_gym("Gym 1")
+                return await api.get_available_shifts_bulk(INSTANCES)
+
+        available = asyncio.run(run())
+
+    assert len(available) == 4
+    assert {
+        key: [shift.slot_id for shift in shifts] for key, shifts in available.items()
+    } == {key: [shift.slot_id for shift in shifts] for key, shifts in expected.items()}
+
+
+def test_failed_keys_are_left_out():
+    fake = FakeToplogger(gyms=1).start()
+    try:
+        assert asyncio.run(fetch(AsyncToploggerApi(url=fake.url), fake)) == {}
+    finally:
+        fake.stop()
+
+
+def test_timeout():
+    with FakeToplogger(gyms=1) as fake:
+
+        async def run():
+            async with AsyncToploggerApi(url=fake.url, timeout=(0.1, 0.1)) as api:
+                assert await api.pick_gym("Gym 1")
+                fake.latency = 1.0
+                return await api.get_available_shifts_bulk(INSTANCES)
+
+        assert asyncio.run(run()) == {}